@@ -0,0 +1,289 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import concurrent.futures
+from datetime import datetime
+
+import probe
+import ffmpeg_runner
+
+# Đo tốc độ thực tế của từng encoder trên máy này bằng một ASIN tổng hợp cố định
+BENCHMARK_RESULTS_PATH = os.environ.get(
+    "BENCHMARK_RESULTS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.json")
+)
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CANDIDATE_ENCODERS = [
+    'libx264', 'h264_nvenc', 'hevc_nvenc', 'av1_nvenc', 'h264_qsv', 'hevc_qsv', 'av1_qsv',
+    'h264_amf', 'hevc_amf', 'av1_amf', 'h264_mf', 'hevc_mf', 'h264_vaapi', 'hevc_vaapi', 'av1_vaapi',
+]
+ENCODER_PRESETS = {
+    "libx264": ["ultrafast", "veryfast", "medium"],
+    "nvenc": ["p1", "p4", "p5"],
+    "qsv": ["veryfast", "medium"],
+}
+REFERENCE_CODEC = ("libx264", "medium")
+
+# ASIN tổng hợp: (tên file, nguồn lavfi, thời lượng) – Media2 dài để cắt 9s,
+# Media3 4K như quay điện thoại (bị tăng tốc), Media4 ngắn 720p
+SYNTHETIC_MEDIA = [
+    ("media2.mp4", "testsrc2=size=1920x1080:rate=30", 20),
+    ("media3.mp4", "testsrc2=size=3840x2160:rate=30", 40),
+    ("media4.mp4", "mandelbrot=size=1280x720:rate=30", 8),
+]
+SYNTHETIC_SUBTITLE = "BENCH00001 Sample Product Title"
+
+
+def _run(cmd: list) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        cmd,
+        check=True,
+        capture_output=True,
+        text=True,
+        startupinfo=ffmpeg_runner.hidden_startupinfo(),
+        encoding='utf-8',
+        errors='replace'
+    )
+
+
+def detect_working_encoders(candidates: list = None) -> list:
+    """Encoders listed by `ffmpeg -encoders` that can actually encode a few frames on this host"""
+    candidates = candidates or CANDIDATE_ENCODERS
+    try:
+        listed = _run(["ffmpeg", "-hide_banner", "-encoders"]).stdout.lower()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return []
+    working = []
+    for codec in candidates:
+        if codec.lower() not in listed:
+            continue
+        try:
+            _run(["ffmpeg", "-hide_banner", "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30:duration=0.5",
+                  "-pix_fmt", "yuv420p", "-c:v", codec, "-f", "null", "-"])
+            working.append(codec)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            pass
+    return working
+
+
+def presets_for(codec: str) -> list:
+    if codec in ENCODER_PRESETS:
+        return ENCODER_PRESETS[codec]
+    return ENCODER_PRESETS.get(codec.split("_")[-1], [None])
+
+
+def prepare_assets(asset_dir: str) -> dict:
+    """Generate the synthetic ASIN once and return create_video parameters for it"""
+    os.makedirs(asset_dir, exist_ok=True)
+    media_paths = []
+    for name, source, duration in SYNTHETIC_MEDIA:
+        path = os.path.join(asset_dir, name)
+        if not os.path.exists(path):
+            _run(["ffmpeg", "-y", "-f", "lavfi", "-i", f"{source}:duration={duration}",
+                  "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-pix_fmt", "yuv420p", path])
+        media_paths.append(path)
+
+    voice = os.path.join(asset_dir, "voice.m4a")
+    if not os.path.exists(voice):
+        _run(["ffmpeg", "-y", "-f", "lavfi", "-i", "sine=frequency=220:duration=50",
+              "-c:a", "aac", "-b:a", "128k", voice])
+
+    return {
+        "media_paths": media_paths,
+        "audio1": os.path.join(REPO_DIR, "Audio1.mp3"),
+        "audio2": voice,
+        "logo_path": os.path.join(REPO_DIR, "canamax_logo.png"),
+        "bluestars_outtro_path": os.path.join(REPO_DIR, "bluestars_outtro.mp4"),
+        "sub_text": SYNTHETIC_SUBTITLE,
+        "brand": "BlueStars",
+        "use_clip_cache": False,
+    }
+
+
+def quality_scores(path: str, reference: str) -> dict:
+    """PSNR (dB) and SSIM of path against reference, computed by ffmpeg"""
+    graph = "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]ssim;[a1][b1]psnr"
+    try:
+        err = _run(["ffmpeg", "-hide_banner", "-i", path, "-i", reference,
+                    "-lavfi", graph, "-f", "null", "-"]).stderr
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {"psnr": None, "ssim": None}
+    ssim = re.search(r"SSIM .*All:([\d.]+)", err)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", err)
+    return {
+        "psnr": float(psnr.group(1)) if psnr else None,
+        "ssim": float(ssim.group(1)) if ssim else None,
+    }
+
+
+def _children_cpu_time() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(base_params: dict, codec: str, preset: str, workers: int, out_dir: str) -> dict:
+    """Render `workers` copies of the synthetic ASIN concurrently with one encoder setting"""
+    import video
+
+    case_dir = os.path.join(out_dir, f"{codec}_{preset or 'default'}_{workers}")
+    os.makedirs(case_dir, exist_ok=True)
+    jobs = [
+        dict(base_params, asin=f"BENCH{i:05d}", asin_folder=case_dir, codecs=codec, encoder_preset=preset)
+        for i in range(workers)
+    ]
+
+    # Outro encode và nhạc nền decode dùng chung cả batch (main_web làm trước khi render),
+    # không tính vào thời gian của case; các worker cũng không tranh nhau encode chúng
+    video.plan_video(**jobs[0])
+
+    cpu_before = _children_cpu_time()
+    start = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(video.create_video_wrapper, jobs))
+    wall = time.monotonic() - start
+    cpu_after = _children_cpu_time()
+
+    failed = [r for r in results if not r.startswith("✅")]
+    outputs = [os.path.join(case_dir, f"{job['asin']}.mp4") for job in jobs]
+    result = {
+        "codec": codec,
+        "preset": preset,
+        "workers": workers,
+        "ok": not failed,
+        "error": failed[0][:500] if failed else None,
+        "wall_time": round(wall, 3),
+        "cpu_time": round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+    }
+    if failed:
+        return result
+
+    info = probe.probe_media(outputs[0])
+    frames = (info.duration if info else 0.0) * 29.97
+    result.update({
+        "output": outputs[0],
+        "output_size": os.path.getsize(outputs[0]),
+        "video_duration": round(info.duration, 3) if info else None,
+        "fps": round(frames * workers / wall, 2) if wall > 0 else None,
+        "videos_per_hour": round(workers * 3600 / wall, 1) if wall > 0 else None,
+    })
+    return result
+
+
+def run_benchmark(codecs: list = None, worker_levels: list = None, out_path: str = None,
+                  keep_outputs: bool = False) -> dict:
+    import media_cache
+
+    codecs = codecs or detect_working_encoders()
+    if not codecs:
+        raise RuntimeError("No working ffmpeg encoder found")
+    cores = os.cpu_count() or 2
+    worker_levels = worker_levels or sorted({1, 2, 4, max(1, cores // 4), max(1, cores // 2)})
+
+    base_params = prepare_assets(os.path.join(media_cache.MEDIA_CACHE_DIR, "benchmark"))
+    out_dir = tempfile.mkdtemp(prefix="render_bench_")
+    results = []
+    try:
+        for codec in codecs:
+            for preset in presets_for(codec):
+                for workers in worker_levels:
+                    print(f"⏱️ {codec} preset={preset} workers={workers} ...")
+                    res = run_case(base_params, codec, preset, workers, out_dir)
+                    print(f"   {'✅' if res['ok'] else '❌'} {res.get('wall_time')}s, fps={res.get('fps')}")
+                    results.append(res)
+
+        # Chất lượng so với encode production mặc định (libx264 medium)
+        reference = next((r["output"] for r in results
+                          if r["ok"] and (r["codec"], r["preset"]) == REFERENCE_CODEC), None)
+        for res in results:
+            if res["ok"]:
+                res.update(quality_scores(res["output"], reference) if reference else {"psnr": None, "ssim": None})
+                res.pop("output")
+    finally:
+        if not keep_outputs:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "cpu_count": cores},
+        "quality_reference": "/".join(REFERENCE_CODEC),
+        "results": results,
+        "best": best_configs(results),
+    }
+    with open(out_path or BENCHMARK_RESULTS_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def is_production_preset(codec: str, preset: str) -> bool:
+    """True for the preset renders actually encode with (video.get_video_encode_args default)"""
+    import video
+    return preset in (None, video.default_encoder_preset(codec))
+
+
+def best_configs(results: list) -> dict:
+    """Highest-throughput (fps across all workers) worker count per codec, at the production preset.
+
+    Faster presets are only reported in results: their fps would overestimate
+    the speed of real renders and the worker count chosen from it.
+    """
+    best = {}
+    for res in results:
+        if not res.get("ok") or not res.get("fps") or not is_production_preset(res["codec"], res["preset"]):
+            continue
+        cur = best.get(res["codec"])
+        if cur is None or res["fps"] > cur["fps"]:
+            best[res["codec"]] = {k: res[k] for k in ("preset", "workers", "fps", "videos_per_hour")}
+    return best
+
+
+def load_results(path: str = None) -> dict:
+    try:
+        with open(path or BENCHMARK_RESULTS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def recommended(codec: str, path: str = None) -> dict:
+    """Benchmarked best {preset, workers, ...} for codec on this host, or None"""
+    report = load_results(path)
+    if report.get("host", {}).get("cpu_count") != (os.cpu_count() or 2):
+        return None  # Kết quả của máy khác
+    best = report.get("best", {}).get(codec)
+    if best and not is_production_preset(codec, best.get("preset")):
+        return None  # Kết quả cũ chọn preset nhanh nhất, không phải preset production
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ffmpeg encoders with a synthetic ASIN render")
+    parser.add_argument("--codecs", nargs="*", help="Encoders to test (default: all working encoders)")
+    parser.add_argument("--workers", nargs="*", type=int, help="Parallelism levels (default: 1 2 4 cores/4 cores/2)")
+    parser.add_argument("--out", default=BENCHMARK_RESULTS_PATH, help="Where to write the JSON results")
+    parser.add_argument("--keep-outputs", action="store_true", help="Keep rendered benchmark videos")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.codecs, args.workers, args.out, args.keep_outputs)
+    for codec, best in report["best"].items():
+        print(f"🏆 {codec}: preset={best['preset']} workers={best['workers']} "
+              f"{best['fps']} fps, {best['videos_per_hour']} videos/h")
+    print(f"✅ Results saved to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
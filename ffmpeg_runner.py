@@ -0,0 +1,175 @@
+import time
+import platform
+import threading
+import subprocess
+from collections import deque
+
+# Encode chậm hơn mức này (media giây / giây thực) sau vài giây đầu được đánh dấu "slow",
+# ví dụ codec GPU âm thầm fallback về CPU
+SLOW_SPEED_FACTOR = 0.5
+SLOW_GRACE_SECONDS = 5.0
+STDERR_TAIL_LINES = 200
+
+# Watchdog: timeout tỉ lệ với thời lượng output, kill khi tiến độ đứng yên quá lâu
+TIMEOUT_MIN_SECONDS = 300
+TIMEOUT_PER_MEDIA_SECOND = 30
+STALL_SECONDS = 120
+WATCHDOG_INTERVAL = 1.0
+
+
+class RenderAborted(RuntimeError):
+    """ffmpeg was killed by the watchdog (timeout, stall or operator cancellation)"""
+
+    def __init__(self, reason: str, stderr: str = ""):
+        super().__init__(reason)
+        self.reason = reason
+        self.stderr = stderr
+
+
+def render_timeout(expected_duration: float) -> float:
+    """Wall-clock limit for a render producing expected_duration seconds of video"""
+    return max(TIMEOUT_MIN_SECONDS, (expected_duration or 0) * TIMEOUT_PER_MEDIA_SECOND)
+
+
+def hidden_startupinfo():
+    """Hide the console window of ffmpeg on Windows"""
+    if platform.system() == 'Windows':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        return startupinfo
+    return None
+
+
+def _to_float(value, default=0.0) -> float:
+    try:
+        return float(str(value).rstrip("x"))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_progress(block: dict, expected_duration: float, elapsed: float, label: str = "") -> dict:
+    """Turn one `-progress` key=value block into a progress event"""
+    out_us = block.get("out_time_us") or block.get("out_time_ms")
+    out_time = _to_float(out_us) / 1_000_000
+    speed = _to_float(block.get("speed"))
+    done = block.get("progress") == "end"
+
+    percent = 0.0
+    eta = None
+    if expected_duration and expected_duration > 0:
+        percent = 100.0 if done else min(99.9, out_time / expected_duration * 100)
+        remaining = max(expected_duration - out_time, 0.0)
+        if done:
+            eta = 0.0
+        elif speed > 0:
+            eta = remaining / speed
+
+    return {
+        "label": label,
+        "frame": int(_to_float(block.get("frame"))),
+        "fps": _to_float(block.get("fps")),
+        "speed": speed,
+        "out_time": out_time,
+        "percent": percent,
+        "eta": eta,
+        "elapsed": elapsed,
+        "slow": not done and elapsed > SLOW_GRACE_SECONDS and 0 < speed < SLOW_SPEED_FACTOR,
+        "done": done,
+        "aborted": None,
+    }
+
+
+def run_ffmpeg(cmd: list, expected_duration: float = 0.0, on_progress=None, label: str = "",
+               timeout: float = None, stall_timeout: float = None, should_cancel=None) -> str:
+    """Run ffmpeg with `-progress pipe:1`, reporting progress events while it encodes.
+
+    on_progress(event) is called for every progress block (about twice a second).
+    A watchdog thread kills ffmpeg after `timeout` seconds, when the output time
+    has not advanced for `stall_timeout` seconds, or when should_cancel() returns
+    True, and RenderAborted is raised. Other failures raise
+    subprocess.CalledProcessError with the stderr tail, like subprocess.run(check=True);
+    returns the stderr tail on success.
+    """
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        text=True,
+        startupinfo=hidden_startupinfo(),
+        encoding='utf-8',
+        errors='replace'
+    )
+
+    # Đọc stderr ở thread riêng để pipe không bị đầy
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    reader = threading.Thread(target=lambda: stderr_tail.extend(proc.stderr), daemon=True)
+    reader.start()
+
+    start = time.monotonic()
+    state = {"last_advance": start, "out_time": -1.0, "aborted": None}
+    finished = threading.Event()
+
+    def watchdog():
+        while not finished.wait(WATCHDOG_INTERVAL):
+            now = time.monotonic()
+            reason = None
+            if timeout and now - start > timeout:
+                reason = f"timeout after {timeout:.0f}s"
+            elif stall_timeout and now - state["last_advance"] > stall_timeout:
+                reason = f"stalled: no progress for {stall_timeout:.0f}s"
+            else:
+                try:
+                    if should_cancel and should_cancel():
+                        reason = "cancelled by operator"
+                except Exception:
+                    pass
+            if reason:
+                state["aborted"] = reason
+                proc.kill()
+                return
+
+    guard = threading.Thread(target=watchdog, daemon=True)
+    guard.start()
+
+    block = {}
+    try:
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if not key:
+                continue
+            block[key] = value
+            if key == "progress":
+                event = parse_progress(block, expected_duration, time.monotonic() - start, label)
+                state["event"] = event
+                if event["out_time"] > state["out_time"]:
+                    state["out_time"] = event["out_time"]
+                    state["last_advance"] = time.monotonic()
+                if on_progress:
+                    try:
+                        on_progress(event)
+                    except Exception as e:
+                        print(f"⚠️ Progress callback failed: {e}")
+                block = {}
+        proc.wait()
+    finally:
+        finished.set()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    reader.join(timeout=5)
+    stderr = "".join(stderr_tail)
+    if state["aborted"]:
+        if on_progress:
+            try:
+                last = state.get("event") or parse_progress({}, expected_duration, time.monotonic() - start, label)
+                on_progress(dict(last, aborted=state["aborted"], done=False))
+            except Exception:
+                pass
+        raise RenderAborted(state["aborted"], stderr)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+    return stderr
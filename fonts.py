@@ -0,0 +1,160 @@
+import os
+import platform
+from functools import lru_cache
+
+# Font lookups and text measurement shared by the render workers and the webapp preview.
+# Everything is memoized per process: font discovery hits the filesystem once, each
+# (font, size) face is loaded once, and each subtitle is fitted once.
+# PIL is imported on first use so importing the render engine stays cheap.
+
+@lru_cache(maxsize=None)
+def get_system_font():
+    """Get system font path for different operating systems"""
+    system = platform.system().lower()
+    
+    if system == 'windows':
+        # Windows fonts
+        font_paths = [
+            "C:/Windows/Fonts/arialbd.ttf",
+            "C:/Windows/Fonts/arial.ttf",
+            "C:/Windows/Fonts/calibrib.ttf",
+            "C:/Windows/Fonts/calibri.ttf"
+        ]
+    elif system == 'darwin':  # macOS
+        font_paths = [
+            "/System/Library/Fonts/Arial.ttc",
+            "/System/Library/Fonts/Helvetica.ttc",
+            "/System/Library/Fonts/AppleSDGothicNeo.ttc",
+            "/Library/Fonts/Arial.ttf"
+        ]
+    else:  # Linux and others
+        font_paths = [
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+            "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+            "/usr/share/fonts/ubuntu/Ubuntu-Bold.ttf",
+            "/usr/share/fonts/truetype/ubuntu/Ubuntu-Bold.ttf"
+        ]
+    
+    # Try to find an existing font
+    for font_path in font_paths:
+        if os.path.exists(font_path):
+            return font_path
+    
+    # If no system font found, return None (will use default)
+    return None
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_font_path():
+    """Get font path for FFmpeg with proper escaping for different OS"""
+    system = platform.system().lower()
+    
+    if system == 'windows':
+        # Windows - use double backslashes for FFmpeg
+        font_paths = [
+            'C\\:/Windows/Fonts/arialbd.ttf',
+            'C\\:/Windows/Fonts/arial.ttf',
+            'C\\:/Windows/Fonts/calibrib.ttf'
+        ]
+    elif system == 'darwin':  # macOS
+        font_paths = [
+            '/System/Library/Fonts/Arial.ttc',
+            '/System/Library/Fonts/Helvetica.ttc',
+            '/Library/Fonts/Arial.ttf'
+        ]
+    else:  # Linux
+        font_paths = [
+            '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+            '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+            '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'
+        ]
+    
+    # For Windows, check actual file existence without escape chars
+    if system == 'windows':
+        for i, font_path in enumerate(font_paths):
+            actual_path = font_path.replace('\\:/', ':/')
+            if os.path.exists(actual_path):
+                return font_path
+    else:
+        for font_path in font_paths:
+            if os.path.exists(font_path):
+                return font_path
+    
+    # Fallback to a generic font name
+    return 'Arial' if system == 'windows' else 'DejaVu Sans'
+
+
+@lru_cache(maxsize=256)
+def load_font(font_path: str, size: int):
+    """Load a TrueType face once per (path, size); falls back to PIL's default font"""
+    from PIL import ImageFont
+
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size=size)
+        except (IOError, OSError):
+            pass
+    return ImageFont.load_default()
+
+
+def text_width(text: str, font_path: str, size: int) -> float:
+    font = load_font(font_path, size)
+    return font.getlength(text) if hasattr(font, 'getlength') else font.getsize(text)[0]
+
+
+@lru_cache(maxsize=4096)
+def fit_font_size(text: str, font_path: str, max_width: int, max_size: int, min_size: int) -> int:
+    """Largest font size in (min_size, max_size] whose rendered text fits max_width.
+
+    Binary search over the size (text width grows with size); returns min_size
+    when even min_size + 1 is too wide, like the old one-pixel-at-a-time loop.
+    """
+    lo, hi = min_size + 1, max_size
+    best = min_size if max_size > min_size else max_size
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        try:
+            fits = text_width(text, font_path, mid) <= max_width
+        except Exception:
+            return max_size
+        if fits:
+            best, lo = mid, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def render_subtitle(text: str, font_path: str, fontsize: int, fontcolor: str = "#000000",
+                    borderw: int = 2, bordercolor: str = "#FFFFFF"):
+    """Rasterize a subtitle line tightly cropped on a transparent background.
+
+    Returns (image, dx, dy, text_w): dx/dy is where the crop's top-left sits
+    relative to the drawtext origin, text_w the advance width used for alignment.
+    """
+    from PIL import Image, ImageDraw
+
+    font = load_font(font_path, fontsize)
+    left, top, right, bottom = font.getbbox(text, stroke_width=borderw)
+    image = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text(
+        (-left, -top), text, font=font, fill=fontcolor,
+        stroke_width=borderw, stroke_fill=bordercolor
+    )
+    return image, left, top, text_width(text, font_path, fontsize)
+
+
+def subtitle_x(align: str, text_w: float, margin: int, frame_w: int) -> int:
+    """Same horizontal placement as the drawtext x expression in create_video"""
+    if align == 'center':
+        return int((frame_w - text_w) / 2)
+    if align == 'left':
+        return margin
+    return int(frame_w - text_w - margin)
+
+
+def draw_subtitle(canvas, text: str, font_path: str, fontsize: int, fontcolor: str, borderw: int,
+                  bordercolor: str, align: str, y: int, margin: int) -> None:
+    """Paste the rasterized subtitle onto a PIL canvas exactly where the render puts it"""
+    image, dx, dy, text_w = render_subtitle(text, font_path, fontsize, fontcolor, borderw, bordercolor)
+    x = subtitle_x(align, text_w, margin, canvas.width)
+    canvas.paste(image, (x + dx, y + dy), image)
@@ -4,7 +4,13 @@ import pandas as pd
 from typing import List
 import cv2
 
+import probe
+
 def get_video_duration(video_path: str) -> float:
+    duration = probe.get_duration(video_path)
+    if duration > 0:
+        return duration
+    # Fallback khi không có ffprobe
     try:
         cap = cv2.VideoCapture(video_path)
         if cap.isOpened():
@@ -0,0 +1,301 @@
+import os
+import json
+import math
+import hashlib
+import subprocess
+
+import probe
+import ffmpeg_runner
+import resources
+
+# Cache các asset trung gian dùng chung giữa các lần render (clip đã chuẩn hoá, ...)
+MEDIA_CACHE_DIR = os.environ.get(
+    "MEDIA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".render_cache")
+)
+MEDIA_CACHE_MAX_BYTES = int(float(os.environ.get("MEDIA_CACHE_MAX_GB", "20")) * 1024 ** 3)
+# Tăng khi đổi cách encode clip trung gian
+CLIP_CACHE_VERSION = 1
+
+# Định dạng chuẩn của clip trung gian (mezzanine)
+CLIP_FPS = "30000/1001"
+CLIP_PIX_FMT = "yuv420p"
+CLIP_ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "14", "-g", "30"]
+
+OUTRO_DURATION = 3
+
+# Nhạc nền (Audio1) decode sẵn thành PCM float32 ở sample rate output, đã lặp và chỉnh
+# volume; độ dài làm tròn lên theo bucket để mọi job trong batch dùng chung một file
+MUSIC_SAMPLE_RATE = 48000
+MUSIC_BUCKET_SECONDS = 300
+
+
+def _run_ffmpeg(cmd: list, expected_duration: float = 0.0, label: str = "", should_cancel=None,
+                threads: int = None) -> None:
+    """Run one cache encode under the render watchdog (timeout, stall, cancel flag),
+    limited to the job's thread budget when threads is given.
+
+    RenderAborted propagates: a corrupt input must fail the job, not fall back to
+    decoding the same source again in the main render.
+    """
+    ffmpeg_runner.run_ffmpeg(
+        resources.apply_thread_budget(cmd, threads), expected_duration, label=label,
+        timeout=ffmpeg_runner.render_timeout(expected_duration),
+        stall_timeout=ffmpeg_runner.STALL_SECONDS,
+        should_cancel=should_cancel
+    )
+
+
+def _cache_key(*parts) -> str:
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+def _cache_path(kind: str, key: str, ext: str) -> str:
+    folder = os.path.join(MEDIA_CACHE_DIR, kind)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{key}{ext}")
+
+
+def _touch(path: str) -> None:
+    """Mark a cache entry as recently used (LRU order is by mtime)"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def evict(max_bytes: int = None) -> int:
+    """Delete least recently used cache files until the cache fits in max_bytes. Returns bytes freed."""
+    max_bytes = MEDIA_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for root, _, files in os.walk(MEDIA_CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            freed += size
+        except OSError:
+            pass
+    return freed
+
+
+def normalized_clip(src: str, filters: str, input_args: list = None, create: bool = True,
+                    should_cancel=None, threads: int = None) -> str:
+    """Return a cached copy of src passed through filters, at 29.97 fps yuv420p without audio.
+
+    The key is the source fingerprint (path, size, mtime) plus the input options
+    (-ss/-t seek) and the filter chain, so the same cut/speed-up of the same file
+    is decoded and scaled only once. With create=False only an existing entry is returned.
+    Returns None if the clip can't be produced; callers then use the source directly.
+    """
+    key_src = probe.file_key(src)
+    if key_src is None or MEDIA_CACHE_MAX_BYTES <= 0:
+        return None
+    out = _cache_path("clips", _cache_key(CLIP_CACHE_VERSION, key_src, input_args or [], filters), ".mp4")
+    if os.path.exists(out):
+        _touch(out)
+        return out
+    if not create:
+        return None
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    vf = f"{filters},fps={CLIP_FPS},format={CLIP_PIX_FMT},setsar=1"
+    cmd = ["ffmpeg", "-y", "-hwaccel", "auto"] + (input_args or []) + ["-i", src, "-vf", vf, "-an"] + CLIP_ENCODE_ARGS + [
+        "-f", "mp4", tmp
+    ]
+    args = input_args or []
+    expected = float(args[args.index("-t") + 1]) if "-t" in args else probe.get_duration(src)
+    try:
+        _run_ffmpeg(cmd, expected, f"{os.path.basename(src)} [clip]", should_cancel, threads)
+        os.replace(tmp, out)
+    except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
+        print(f"⚠️ Clip cache failed for {src}: {e}")
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict()
+    return out if os.path.exists(out) else None
+
+
+def encoded_outro(outro_path: str, video_args: list, width: int = 1920, height: int = 1080,
+                  create: bool = True, fit: str = None, should_cancel=None, threads: int = None) -> str:
+    """Encode the first OUTRO_DURATION seconds of the outro once, in the exact output format.
+
+    video_args must be the same encoder arguments the body is rendered with, so
+    the outro can be appended with a stream-copy concat. The clip has no audio:
+    the render's audio mix is muxed over body + outro when they are joined.
+    fit replaces the default scale to width x height (e.g. a crop/pad for 9:16).
+    Returns None if the outro can't be encoded (or, with create=False, isn't cached yet).
+    """
+    key_src = probe.file_key(outro_path)
+    if key_src is None:
+        return None
+    key = _cache_key(CLIP_CACHE_VERSION, key_src, video_args, width, height, fit)
+    out = _cache_path("outro", key, ".mp4")
+    if os.path.exists(out):
+        _touch(out)
+        return out
+    if not create:
+        return None
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    cmd = ["ffmpeg", "-y", "-t", str(OUTRO_DURATION), "-i", outro_path]
+    cmd += ["-filter_complex", f"[0:v]{fit or f'scale={width}:{height}'},setsar=1,setpts=PTS-STARTPTS[v]",
+            "-map", "[v]", "-an"]
+    cmd += video_args + ["-t", str(OUTRO_DURATION), "-movflags", "+faststart", "-f", "mp4", tmp]
+    try:
+        _run_ffmpeg(cmd, OUTRO_DURATION, "outro", should_cancel, threads)
+        os.replace(tmp, out)
+    except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
+        print(f"⚠️ Cannot pre-encode outro {outro_path}: {e}")
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return out
+
+
+def decoded_music(audio_path: str, volume: float = 1.0, seconds: float = 0.0, create: bool = True,
+                  should_cancel=None, threads: int = None) -> str:
+    """Return a cached WAV of audio_path looped to at least `seconds`, with volume applied.
+
+    The key is the source fingerprint, the volume and the length rounded up to
+    MUSIC_BUCKET_SECONDS, so a whole batch shares one decoded file and each job
+    only reads the slice it needs. Music shorter than the video is looped.
+    Returns None if it can't be decoded (or, with create=False, isn't cached yet).
+    """
+    key_src = probe.file_key(audio_path)
+    if key_src is None or MEDIA_CACHE_MAX_BYTES <= 0:
+        return None
+    length = max(1, math.ceil(seconds / MUSIC_BUCKET_SECONDS)) * MUSIC_BUCKET_SECONDS
+    out = _cache_path("music", _cache_key(CLIP_CACHE_VERSION, key_src, volume, length, MUSIC_SAMPLE_RATE), ".wav")
+    if os.path.exists(out):
+        _touch(out)
+        return out
+    if not create:
+        return None
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    cmd = ["ffmpeg", "-y", "-stream_loop", "-1", "-i", audio_path, "-t", str(length), "-vn",
+           "-af", f"volume={volume}", "-ar", str(MUSIC_SAMPLE_RATE), "-ac", "2", "-c:a", "pcm_f32le",
+           "-f", "wav", tmp]
+    try:
+        _run_ffmpeg(cmd, length, "music", should_cancel, threads)
+        os.replace(tmp, out)
+    except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
+        print(f"⚠️ Cannot decode background music {audio_path}: {e}")
+        return None
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict()
+    return out if os.path.exists(out) else None
+
+
+def input_key(path: str):
+    """Cache-key part for a layer input: files of this cache are content-addressed (their
+    mtime moves on every hit), anything else is identified by size + mtime"""
+    if not path:
+        return None
+    if os.path.abspath(path).startswith(os.path.abspath(MEDIA_CACHE_DIR) + os.sep):
+        return os.path.basename(path)
+    return probe.file_key(path) or path
+
+
+def cached_layer(kind: str, key_parts, build) -> str:
+    """Path of a cached render layer (mp4); build(tmp_path) produces it the first time.
+
+    key_parts must identify every input of the layer (file fingerprints, graph,
+    encoder arguments). Errors from build propagate, leaving no partial file.
+    """
+    out = _cache_path("layers", _cache_key(CLIP_CACHE_VERSION, kind, key_parts), ".mp4")
+    if os.path.exists(out):
+        _touch(out)
+        return out
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        build(tmp)
+        os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict()
+    return out
+
+
+def scaled_logo(logo_path: str, width: int) -> str:
+    """Resize the logo once to the overlay width (keeping aspect) and cache it as an RGBA PNG"""
+    key_src = probe.file_key(logo_path)
+    if key_src is None or width <= 0:
+        return None
+    out = _cache_path("logo", _cache_key(CLIP_CACHE_VERSION, key_src, width), ".png")
+    if os.path.exists(out):
+        _touch(out)
+        return out
+
+    from PIL import Image
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        with Image.open(logo_path) as logo:
+            logo = logo.convert("RGBA")
+            height = max(1, round(logo.height * width / logo.width))
+            logo.resize((width, height), Image.Resampling.LANCZOS).save(tmp, format="PNG")
+        os.replace(tmp, out)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Cannot pre-scale logo {logo_path}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    return out
+
+
+def subtitle_image(text: str, font_path: str, fontsize: int, fontcolor: str, borderw: int,
+                   bordercolor: str, align: str, y: int, margin: int, frame_w: int = 1920):
+    """Rasterized subtitle PNG for a static overlay, cached by text and style.
+
+    Returns (png path, x, y) of the overlay on the frame, or None on failure.
+    """
+    import fonts
+
+    key = _cache_key(CLIP_CACHE_VERSION, text, probe.file_key(font_path) if font_path else None,
+                     fontsize, fontcolor, borderw, bordercolor, align, y, margin, frame_w)
+    out = _cache_path("subtitle", key, ".png")
+    meta = f"{out}.json"
+    if os.path.exists(out) and os.path.exists(meta):
+        _touch(out)
+        with open(meta, "r", encoding="utf-8") as f:
+            pos = json.load(f)
+        return out, pos["x"], pos["y"]
+
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        image, dx, dy, text_w = fonts.render_subtitle(text, font_path, fontsize, fontcolor, borderw, bordercolor)
+        x = fonts.subtitle_x(align, text_w, margin, frame_w) + dx
+        top = y + dy
+        image.save(tmp, format="PNG")
+        with open(meta, "w", encoding="utf-8") as f:
+            json.dump({"x": x, "y": top}, f)
+        os.replace(tmp, out)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Cannot rasterize subtitle: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    return out, x, top
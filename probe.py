@@ -0,0 +1,229 @@
+import os
+import json
+import sqlite3
+import platform
+import threading
+import subprocess
+from dataclasses import dataclass, asdict
+
+# SQLite cache shared by every process that probes media (webapp, render workers)
+PROBE_CACHE_PATH = os.environ.get(
+    "PROBE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".probe_cache.sqlite")
+)
+PROBE_SCHEMA = 3
+
+# Container có index: -ss trên input nhảy thẳng tới keyframe gần nhất rồi giải mã chính xác
+SEEKABLE_FORMATS = ("mov", "mp4", "matroska", "webm", "avi")
+
+_lock = threading.Lock()
+_memo = {}
+_conn = None
+_conn_pid = None
+
+
+def _startupinfo():
+    """Hide the console window of ffprobe on Windows"""
+    if platform.system() == 'Windows':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        return startupinfo
+    return None
+
+
+def _get_conn():
+    """Open (once per process) the on-disk probe cache"""
+    global _conn, _conn_pid
+    if _conn is not None and _conn_pid == os.getpid():
+        return _conn
+    try:
+        conn = sqlite3.connect(PROBE_CACHE_PATH, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " schema INTEGER, data TEXT)"
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Probe cache disabled ({PROBE_CACHE_PATH}): {e}")
+        conn = None
+    _conn, _conn_pid = conn, os.getpid()
+    return _conn
+
+
+def file_key(path: str):
+    """Return (abs path, size, mtime_ns) identifying the current file content, or None"""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return os.path.abspath(str(path)), st.st_size, st.st_mtime_ns
+
+
+def _lookup(key):
+    if key in _memo:
+        return _memo[key]
+    conn = _get_conn()
+    if conn is None:
+        return None
+    path, size, mtime_ns = key
+    with _lock:
+        try:
+            row = conn.execute(
+                "SELECT data FROM probe WHERE path=? AND size=? AND mtime_ns=? AND schema=?",
+                (path, size, mtime_ns, PROBE_SCHEMA)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+    if row is None:
+        return None
+    data = json.loads(row[0])
+    _memo[key] = data
+    return data
+
+
+def _store(key, data):
+    _memo[key] = data
+    conn = _get_conn()
+    if conn is None:
+        return
+    path, size, mtime_ns = key
+    with _lock:
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO probe (path, size, mtime_ns, schema, data) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, PROBE_SCHEMA, json.dumps(data))
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Cannot write probe cache for {path}: {e}")
+
+
+@dataclass
+class MediaInfo:
+    """What the render needs to know about one input file"""
+    duration: float = 0.0
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    pix_fmt: str = ""
+    codec: str = ""
+    has_audio: bool = False
+    rotation: int = 0
+    format_name: str = ""
+
+    @property
+    def display_size(self) -> tuple:
+        """(width, height) after the player/ffmpeg applies the rotation metadata"""
+        if self.rotation % 180:
+            return self.height, self.width
+        return self.width, self.height
+
+    def matches(self, width: int, height: int, pix_fmt: str = "yuv420p") -> bool:
+        """True if the video stream can go into the graph without scale/format conversion"""
+        return self.display_size == (width, height) and self.pix_fmt == pix_fmt
+
+    def can_seek(self, start: float, length: float) -> bool:
+        """True if input-side -ss/-t gives the same frames as a trim filter for this range"""
+        formats = self.format_name.split(",")
+        return (any(f in SEEKABLE_FORMATS for f in formats)
+                and self.duration > 0 and 0 <= start and start + length <= self.duration)
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        num, _, den = str(rate).partition("/")
+        num, den = float(num), float(den or 1)
+        return num / den if den else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _parse_rotation(stream: dict) -> int:
+    rotation = stream.get("tags", {}).get("rotate")
+    for side in stream.get("side_data_list", []):
+        if "rotation" in side:
+            rotation = side["rotation"]
+    try:
+        return int(float(rotation or 0)) % 360
+    except ValueError:
+        return 0
+
+
+def _parse_probe(out: dict) -> dict:
+    streams = out.get("streams", [])
+    fmt = out.get("format", {})
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    try:
+        duration = float(fmt.get("duration") or video.get("duration") or 0.0)
+    except ValueError:
+        duration = 0.0
+    info = MediaInfo(
+        duration=duration,
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        fps=_parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+        pix_fmt=video.get("pix_fmt", ""),
+        codec=video.get("codec_name", ""),
+        has_audio=any(s.get("codec_type") == "audio" for s in streams),
+        rotation=_parse_rotation(video),
+        format_name=fmt.get("format_name", ""),
+    )
+    return asdict(info)
+
+
+def _run_ffprobe(path: str) -> dict:
+    """Single ffprobe call for format and streams. Returns None if the file can't be probed."""
+    cmd = [
+        "ffprobe", "-v", "error", "-show_streams", "-show_format",
+        "-of", "json", path
+    ]
+    try:
+        res = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=True,
+            startupinfo=_startupinfo(),
+            encoding='utf-8',
+            errors='replace'
+        )
+        return _parse_probe(json.loads(res.stdout or "{}"))
+    except (subprocess.CalledProcessError, ValueError, FileNotFoundError):
+        return None
+
+
+def probe(path: str) -> dict:
+    """Probe a media file, reusing the cached result while size and mtime are unchanged"""
+    key = file_key(path)
+    if key is None:
+        return None
+    data = _lookup(key)
+    if data is None:
+        data = _run_ffprobe(key[0])
+        if data is not None:
+            _store(key, data)
+    return data
+
+
+def probe_media(path: str) -> MediaInfo:
+    """Typed probe result (duration, size, fps, pix_fmt, codec, audio, rotation), or None"""
+    data = probe(path)
+    return MediaInfo(**data) if data else None
+
+
+def get_duration(path: str) -> float:
+    """Duration in seconds of a media file (0.0 if it can't be probed)"""
+    info = probe_media(path)
+    return info.duration if info else 0.0
+
+
+def probe_many(paths: list, max_workers: int = 8) -> dict:
+    """Probe many files in parallel (ffprobe runs outside the GIL); returns {path: MediaInfo or None}"""
+    import concurrent.futures
+
+    unique = list(dict.fromkeys(str(p) for p in paths))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as ex:
+        return dict(zip(unique, ex.map(probe_media, unique)))
@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+
+# Cờ huỷ render dạng file trong thư mục output: worker ở mọi process (và mọi máy
+# dùng chung thư mục) đều thấy được mà không cần kênh giao tiếp riêng
+CANCEL_DIR = ".render_cancel"
+BATCH_FLAG = "_batch"
+
+
+def _flag_path(folder: str, asin: str = None) -> str:
+    return os.path.join(folder, CANCEL_DIR, asin or BATCH_FLAG)
+
+
+def request_cancel(folder: str, asin: str = None) -> None:
+    """Ask running renders to stop: one ASIN, or the whole batch when asin is None"""
+    path = _flag_path(folder, asin)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("cancel\n")
+
+
+def is_cancelled(folder: str, asin: str = None) -> bool:
+    if os.path.exists(_flag_path(folder)):
+        return True
+    return bool(asin) and os.path.exists(_flag_path(folder, asin))
+
+
+def clear_stale(folder: str, since: float, asin: str = None) -> None:
+    """Remove batch / ASIN flags written before `since` (e.g. a job's enqueue time):
+    a cancel of an earlier run must not cancel work queued after it"""
+    for path in (_flag_path(folder), _flag_path(folder, asin) if asin else None):
+        try:
+            if path and os.path.getmtime(path) < since:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def clear_cancel(folder: str, asin: str = None) -> None:
+    """Remove the flag of one ASIN, or every flag when asin is None"""
+    cancel_dir = os.path.join(folder, CANCEL_DIR)
+    names = [asin] if asin else (os.listdir(cancel_dir) if os.path.isdir(cancel_dir) else [])
+    for name in names:
+        try:
+            os.remove(os.path.join(cancel_dir, name))
+        except OSError:
+            pass
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cancel running video renders")
+    parser.add_argument("action", choices=["cancel", "clear"])
+    parser.add_argument("output_folder", help="Output folder of the render batch")
+    parser.add_argument("asins", nargs="*", help="ASINs to cancel (default: whole batch)")
+    args = parser.parse_args(argv)
+
+    for asin in args.asins or [None]:
+        if args.action == "cancel":
+            request_cancel(args.output_folder, asin)
+            print(f"⏹️ Cancel requested: {asin or 'whole batch'}")
+        else:
+            clear_cancel(args.output_folder, asin)
+            print(f"🧹 Cleared: {asin or 'all flags'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+
+import probe
+
+MANIFEST_NAME = "render_manifest.json"
+# Tăng khi thay đổi filter graph / tham số encode để buộc render lại toàn bộ
+RENDER_ENGINE_VERSION = 5
+
+# Tham số của create_video là đường dẫn file: fingerprint theo nội dung (size + mtime)
+FILE_PARAMS = ("media_paths", "audio1", "audio2", "logo_path", "bluestars_outtro_path")
+# Không ảnh hưởng tới nội dung video
+IGNORED_PARAMS = ("asin_folder", "progress_queue", "ffmpeg_threads", "split_segments")
+# Phụ đề mềm (file .srt cạnh video / track mov_text) không nằm trong hình: đổi chữ
+# không đổi fingerprint video, chỉ cần remux stream copy
+SOFT_SUBTITLE_MODES = ("srt", "track")
+
+
+def _file_fingerprint(path):
+    if not path:
+        return None
+    key = probe.file_key(path)
+    return list(key) if key else [str(path), None, None]
+
+
+def fingerprint(params: dict) -> str:
+    """Hash every input of one create_video call: file contents (size/mtime) and all render parameters"""
+    data = {"engine": RENDER_ENGINE_VERSION}
+    soft = params.get("subtitle_mode") in SOFT_SUBTITLE_MODES
+    for name, value in sorted(params.items()):
+        if name in IGNORED_PARAMS or (soft and name == "sub_text"):
+            continue
+        if name == "media_paths":
+            value = [_file_fingerprint(p) for p in value]
+        elif name in FILE_PARAMS:
+            value = _file_fingerprint(value)
+        data[name] = value
+    blob = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def subtitle_fingerprint(params: dict) -> str:
+    """Hash of a soft subtitle (text + mode); None when the subtitle is burned into the picture"""
+    if params.get("subtitle_mode") not in SOFT_SUBTITLE_MODES:
+        return None
+    blob = json.dumps([params.get("subtitle_mode"), params.get("sub_text")], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def load_manifest(folder: str) -> dict:
+    path = os.path.join(folder, MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(folder: str, manifest: dict) -> None:
+    """Write the manifest atomically so a crash never leaves a half-written file"""
+    path = os.path.join(folder, MANIFEST_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def is_up_to_date(manifest: dict, asin: str, fp: str, outputs: list = None) -> bool:
+    """True if this ASIN was rendered from exactly these inputs and the output still exists
+
+    outputs: every file the job writes (extra profile variants); all must still exist.
+    """
+    entry = manifest.get(asin) or {}
+    output = entry.get("output")
+    if entry.get("fingerprint") != fp or not output:
+        return False
+    return all(os.path.exists(p) for p in [output, *(outputs or [])])
+
+
+def record(manifest: dict, asin: str, fp: str, output: str, subtitle: str = None) -> None:
+    manifest[asin] = {
+        "fingerprint": fp,
+        "subtitle": subtitle,
+        "output": output,
+        "rendered_at": datetime.now().isoformat(timespec="seconds"),
+    }
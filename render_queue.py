@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import sqlite3
+import pathlib
+import platform
+import threading
+
+# Hàng đợi render bền vững (SQLite trong thư mục output): mỗi ASIN là một dòng với
+# trạng thái, số lần thử, thời gian và output. Process chết giữa chừng thì lần chạy
+# sau tiếp tục đúng chỗ đã dừng.
+QUEUE_NAME = "render_queue.sqlite"
+MAX_ATTEMPTS = 3
+
+# Worker giữ job bằng lease và gia hạn bằng heartbeat; lease hết hạn (worker chết,
+# máy mất mạng) thì job quay lại hàng đợi cho worker khác
+LEASE_SECONDS = 90
+HEARTBEAT_SECONDS = 20
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    asin TEXT PRIMARY KEY,
+    row_idx INTEGER,
+    fingerprint TEXT,
+    params TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    enqueued_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    output TEXT,
+    error TEXT,
+    lease_until REAL
+)
+"""
+# Cột thêm sau phiên bản đầu của bảng
+_MIGRATIONS = {"lease_until": "REAL"}
+
+
+def worker_id() -> str:
+    return f"{platform.node()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if platform.system() == 'Windows':
+        # os.kill trên Windows sẽ kết thúc process, phải hỏi qua WinAPI
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dead_local_workers(conn: sqlite3.Connection) -> list:
+    """Workers of this host holding running jobs whose process no longer exists"""
+    prefix = f"{platform.node()}:"
+    dead = []
+    for row in conn.execute("SELECT DISTINCT worker FROM jobs WHERE state=? AND worker LIKE ?",
+                            (RUNNING, prefix + "%")):
+        pid = row["worker"][len(prefix):]
+        if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            dead.append(row["worker"])
+    return dead
+
+
+def queue_path(folder: str) -> str:
+    return os.path.join(folder, QUEUE_NAME)
+
+
+def connect(folder: str) -> sqlite3.Connection:
+    """Open the queue of an output folder (created on first use)"""
+    os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(queue_path(folder), timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # Rollback journal, không dùng WAL: shared-memory index của WAL không chia sẻ
+    # được giữa các máy, nên hàng đợi trên ổ mạng sẽ hỏng khi máy thứ hai kết nối
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute(_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for name, kind in _MIGRATIONS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+    return conn
+
+
+def connect_readonly(folder: str) -> sqlite3.Connection:
+    """Inspect the queue without changing it (an empty in-memory queue if there is none yet)"""
+    path = queue_path(folder)
+    if os.path.exists(path):
+        uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=60, isolation_level=None)
+    else:
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        conn.execute(_SCHEMA)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _write(conn: sqlite3.Connection, sql: str, args: tuple = ()) -> int:
+    """Run one write in its own immediate transaction; returns the number of changed rows"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        changed = conn.execute(sql, args).rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return changed
+
+
+def get(conn: sqlite3.Connection, asin: str) -> dict:
+    row = conn.execute("SELECT * FROM jobs WHERE asin=?", (asin,)).fetchone()
+    return dict(row) if row else None
+
+
+def sync(conn: sqlite3.Connection, jobs: dict, fingerprints: dict, force: bool = False,
+         outputs: dict = None) -> None:
+    """Add or update one row per job (jobs: {row idx: create_video params}).
+
+    A row whose inputs changed (new fingerprint), or every row with force,
+    starts over as pending. Otherwise the stored state is kept: done stays
+    done while its output exists (and every file in outputs[idx], the extra
+    profile variants), and failed or cancelled rows are retried while
+    attempts remain.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for idx, params in jobs.items():
+            asin = params["asin"]
+            fp = fingerprints[idx]
+            blob = json.dumps(params, ensure_ascii=False, default=str)
+            row = conn.execute("SELECT fingerprint, state, attempts, output FROM jobs WHERE asin=?", (asin,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO jobs (asin, row_idx, fingerprint, params, state, enqueued_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (asin, idx, fp, blob, PENDING, now)
+                )
+            elif force or row["fingerprint"] != fp:
+                conn.execute(
+                    "UPDATE jobs SET row_idx=?, fingerprint=?, params=?, state=?, attempts=0, worker=NULL,"
+                    " enqueued_at=?, started_at=NULL, finished_at=NULL, output=NULL, error=NULL WHERE asin=?",
+                    (idx, fp, blob, PENDING, now, asin)
+                )
+            else:
+                files = [row["output"], *(outputs or {}).get(idx, [])]
+                retry = (row["state"] == CANCELLED
+                         or (row["state"] == FAILED and row["attempts"] < MAX_ATTEMPTS)
+                         or (row["state"] == DONE and not all(f and os.path.exists(f) for f in files)))
+                if retry:
+                    # Đưa lại vào hàng đợi: enqueued_at mới để cờ huỷ cũ không áp dụng
+                    conn.execute(
+                        "UPDATE jobs SET row_idx=?, params=?, state=?, enqueued_at=? WHERE asin=?",
+                        (idx, blob, PENDING, now, asin)
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET row_idx=?, params=? WHERE asin=?",
+                        (idx, blob, asin)
+                    )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def recover(conn: sqlite3.Connection) -> int:
+    """Put running jobs whose lease expired (their worker died) back to pending; returns how many.
+
+    Leases held by a process of this host that no longer exists are released at
+    once, so a restart right after a crash resumes without waiting LEASE_SECONDS.
+    A job that already used all its attempts is marked failed instead.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for worker in _dead_local_workers(conn):
+            conn.execute("UPDATE jobs SET lease_until=0 WHERE state=? AND worker=?", (RUNNING, worker))
+        expired = "state=? AND (lease_until IS NULL OR lease_until < ?)"
+        conn.execute(
+            f"UPDATE jobs SET state=?, finished_at=?, error=? WHERE {expired} AND attempts>=?",
+            (FAILED, now, "worker lost", RUNNING, now, MAX_ATTEMPTS)
+        )
+        requeued = conn.execute(
+            f"UPDATE jobs SET state=?, worker=NULL, lease_until=NULL WHERE {expired}",
+            (PENDING, RUNNING, now)
+        ).rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return requeued
+
+
+def claim(conn: sqlite3.Connection, asin: str, worker: str = None, lease: float = LEASE_SECONDS) -> bool:
+    """Atomically take a pending job; False if another worker already has it or it is finished"""
+    now = time.time()
+    return _write(
+        conn,
+        "UPDATE jobs SET state=?, worker=?, attempts=attempts+1, started_at=?, finished_at=NULL, lease_until=?"
+        " WHERE asin=? AND state=?",
+        (RUNNING, worker or worker_id(), now, now + lease, asin, PENDING)
+    ) == 1
+
+
+def claim_next(conn: sqlite3.Connection, worker: str = None, lease: float = LEASE_SECONDS) -> dict:
+    """Atomically take the next pending job (Excel row order); returns the row with params decoded, or None"""
+    recover(conn)
+    worker = worker or worker_id()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT asin FROM jobs WHERE state=? ORDER BY row_idx LIMIT 1", (PENDING,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET state=?, worker=?, attempts=attempts+1, started_at=?, finished_at=NULL,"
+                " lease_until=? WHERE asin=?",
+                (RUNNING, worker, now, now + lease, row["asin"])
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if row is None:
+        return None
+    job = get(conn, row["asin"])
+    job["params"] = json.loads(job["params"])
+    return job
+
+
+def heartbeat(conn: sqlite3.Connection, asin: str, worker: str = None, lease: float = LEASE_SECONDS) -> bool:
+    """Extend the lease of a job this worker holds; False if the job was given to someone else"""
+    return _write(
+        conn,
+        "UPDATE jobs SET lease_until=? WHERE asin=? AND state=? AND worker=?",
+        (time.time() + lease, asin, RUNNING, worker or worker_id())
+    ) == 1
+
+
+def start_heartbeat(beat, interval: float = HEARTBEAT_SECONDS) -> threading.Event:
+    """Call beat() every interval seconds in a background thread until the returned event is set"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                if beat() is False:
+                    print("⚠️ Lease lost, the job was handed to another worker")
+            except Exception as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
+
+
+def heartbeat_folder(folder: str, asin: str, worker: str = None) -> bool:
+    """heartbeat() with a short-lived connection, safe to call from any thread"""
+    conn = connect(folder)
+    try:
+        return heartbeat(conn, asin, worker)
+    finally:
+        conn.close()
+
+
+def finish(conn: sqlite3.Connection, asin: str, state: str, output: str = None, error: str = None,
+           worker: str = None) -> bool:
+    """Record the outcome; with worker, only if that worker still holds the job"""
+    sql = "UPDATE jobs SET state=?, finished_at=?, output=?, error=?, lease_until=NULL WHERE asin=?"
+    args = (state, time.time(), output, error, asin)
+    if worker:
+        sql += " AND state=? AND worker=?"
+        args += (RUNNING, worker)
+    return _write(conn, sql, args) == 1
+
+
+def counts(conn: sqlite3.Connection) -> dict:
+    return {row["state"]: row["n"] for row in conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
@@ -0,0 +1,258 @@
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import functools
+import itertools
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import render_queue
+import render_control
+
+# Máy render độc lập: nhận job từ hàng đợi của một thư mục output (file SQLite trên
+# ổ dùng chung) hoặc từ coordinator HTTP nhỏ chạy cạnh hàng đợi đó
+#   python render_worker.py enqueue all.xlsx OUTPUT            # đưa batch vào hàng đợi
+#   python render_worker.py serve OUTPUT --port 8765           # coordinator
+#   python render_worker.py work --coordinator http://host:8765
+#   python render_worker.py work --queue /mnt/shared/OUTPUT
+# --queue dựa vào file lock của SQLite: an toàn trên ổ local, còn ổ mạng (NFS/SMB)
+# thì lock thường không tin cậy; nhiều máy nên đi qua coordinator
+DEFAULT_PORT = 8765
+IDLE_POLL_SECONDS = 5
+HTTP_TIMEOUT = 30
+# Chờ giữa các lần thử lại khi coordinator restart hoặc hàng đợi đang bị khoá
+STORE_RETRY_SECONDS = (1, 2, 5, 10, 30, 60)
+
+
+class SqliteStore:
+    """Queue accessed directly: the output folder is on a volume every worker mounts"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _call(self, fn, *args):
+        conn = render_queue.connect(self.folder)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    def claim(self, worker: str) -> dict:
+        return self._call(render_queue.claim_next, worker)
+
+    def heartbeat(self, asin: str, worker: str) -> bool:
+        return self._call(render_queue.heartbeat, asin, worker)
+
+    def finish(self, asin: str, worker: str, state: str, output: str = None, error: str = None) -> bool:
+        return self._call(render_queue.finish, asin, state, output, error, worker)
+
+    def status(self) -> dict:
+        return self._call(render_queue.counts)
+
+
+class HttpStore:
+    """Queue behind a coordinator started with `render_worker.py serve`"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def _post(self, path: str, payload: dict) -> dict:
+        req = urllib.request.Request(
+            f"{self.url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as res:
+            return json.loads(res.read().decode("utf-8"))
+
+    def claim(self, worker: str) -> dict:
+        return self._post("/claim", {"worker": worker}).get("job")
+
+    def heartbeat(self, asin: str, worker: str) -> bool:
+        return self._post("/heartbeat", {"asin": asin, "worker": worker}).get("ok", False)
+
+    def finish(self, asin: str, worker: str, state: str, output: str = None, error: str = None) -> bool:
+        return self._post("/finish", {"asin": asin, "worker": worker, "state": state,
+                                      "output": output, "error": error}).get("ok", False)
+
+    def status(self) -> dict:
+        with urllib.request.urlopen(f"{self.url}/status", timeout=HTTP_TIMEOUT) as res:
+            return json.loads(res.read().decode("utf-8"))
+
+
+def with_retry(call, *args):
+    """Call a store method, waiting out a restarting coordinator or a locked queue instead of exiting"""
+    for attempt in itertools.count():
+        try:
+            return call(*args)
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                raise
+            error = e
+        except (OSError, sqlite3.OperationalError) as e:
+            error = e
+        delay = STORE_RETRY_SECONDS[min(attempt, len(STORE_RETRY_SECONDS) - 1)]
+        print(f"⚠️ Queue unavailable ({error}), retrying in {delay}s")
+        time.sleep(delay)
+
+
+def make_handler(store: SqliteStore):
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def _reply(self, data: dict, code: int = 200):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            try:
+                if self.path == "/status":
+                    self._reply(store.status())
+                else:
+                    self._reply({"error": "not found"}, 404)
+            except sqlite3.Error as e:
+                self._reply({"error": f"queue unavailable: {e}"}, 503)
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                req = json.loads(self.rfile.read(length) or b"{}")
+                worker = req["worker"]
+                if self.path == "/claim":
+                    self._reply({"job": store.claim(worker)})
+                elif self.path == "/heartbeat":
+                    self._reply({"ok": store.heartbeat(req["asin"], worker)})
+                elif self.path == "/finish":
+                    self._reply({"ok": store.finish(req["asin"], worker, req["state"],
+                                                    req.get("output"), req.get("error"))})
+                else:
+                    self._reply({"error": "not found"}, 404)
+            except (KeyError, ValueError) as e:
+                self._reply({"error": f"bad request: {e}"}, 400)
+            except sqlite3.Error as e:
+                # Vd. "database is locked": worker thử lại sau
+                self._reply({"error": f"queue unavailable: {e}"}, 503)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return CoordinatorHandler
+
+
+def serve(folder: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> None:
+    server = ThreadingHTTPServer((host, port), make_handler(SqliteStore(folder)))
+    print(f"🛰️ Coordinator for {render_queue.queue_path(folder)} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def work(store, worker: str = None, output_folder: str = None, threads: int = None,
+         exit_when_idle: bool = False) -> int:
+    """Claim and render jobs until interrupted (or the queue is empty); returns the number rendered"""
+    import video
+
+    worker = worker or render_queue.worker_id()
+    rendered = 0
+    while True:
+        job = with_retry(store.claim, worker)
+        if job is None:
+            if exit_when_idle:
+                return rendered
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+
+        asin = job["asin"]
+        params = dict(job["params"])
+        if output_folder:
+            params["asin_folder"] = output_folder
+        if threads:
+            params["ffmpeg_threads"] = threads
+        print(f"🚀 [{asin}] Claimed by {worker} (attempt {job['attempts']})")
+        # Cờ huỷ còn sót từ lần chạy trước (vd. Streamlit stop) không áp dụng cho job đưa vào sau đó
+        render_control.clear_stale(params["asin_folder"], job["enqueued_at"] or 0, asin)
+
+        stop = render_queue.start_heartbeat(functools.partial(store.heartbeat, asin, worker))
+        try:
+            result = video.create_video_wrapper(params)
+        except BaseException:
+            # Worker bị dừng: trả job lại hàng đợi ngay, không chờ lease hết hạn
+            try:
+                store.finish(asin, worker, render_queue.PENDING)
+            except (OSError, sqlite3.Error) as e:
+                print(f"⚠️ [{asin}] Could not release the job, it returns when its lease expires: {e}")
+            raise
+        finally:
+            stop.set()
+
+        state, output, error = video.queue_outcome(result)
+        if not with_retry(store.finish, asin, worker, state, output, error):
+            print(f"⚠️ [{asin}] Lease lost, result not recorded")
+        print(result)
+        if state == render_queue.DONE:
+            rendered += 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render workers pulling jobs from a shared render queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="Queue every row of an Excel file without rendering")
+    p_enqueue.add_argument("excel_file")
+    p_enqueue.add_argument("output_folder")
+    p_enqueue.add_argument("--outro", help="Outro video appended to every ASIN")
+    p_enqueue.add_argument("--codecs", default="libx264")
+    p_enqueue.add_argument("--force", action="store_true", help="Re-render rows that are already done")
+
+    p_serve = sub.add_parser("serve", help="Run the HTTP coordinator for an output folder's queue")
+    p_serve.add_argument("output_folder")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    p_work = sub.add_parser("work", help="Claim and render jobs")
+    source = p_work.add_mutually_exclusive_group(required=True)
+    source.add_argument("--queue", help="Output folder whose render_queue.sqlite is shared (SQLite file "
+                                        "locking: prefer --coordinator when workers run on several hosts "
+                                        "over a network filesystem)")
+    source.add_argument("--coordinator", help="URL of a coordinator, e.g. http://127.0.0.1:8765")
+    p_work.add_argument("--worker", help="Worker id (default: host:pid)")
+    p_work.add_argument("--output", help="Write videos here instead of the queued output folder")
+    p_work.add_argument("--threads", type=int, help="ffmpeg threads per render")
+    p_work.add_argument("--exit-when-idle", action="store_true", help="Stop when no job is pending")
+
+    p_status = sub.add_parser("status", help="Count jobs per state")
+    source = p_status.add_mutually_exclusive_group(required=True)
+    source.add_argument("--queue")
+    source.add_argument("--coordinator")
+
+    args = parser.parse_args(argv)
+    if args.command == "enqueue":
+        import video
+        logs, _ = video.main_web(args.excel_file, args.output_folder, bluestars_outtro_path=args.outro,
+                                 codecs=args.codecs, force_render=args.force, enqueue_only=True)
+        print("\n".join(logs))
+    elif args.command == "serve":
+        serve(args.output_folder, args.host, args.port)
+    else:
+        store = SqliteStore(args.queue) if args.queue else HttpStore(args.coordinator)
+        if args.command == "status":
+            print(json.dumps(store.status(), indent=2))
+        else:
+            try:
+                count = work(store, args.worker, args.output, args.threads, args.exit_when_idle)
+                print(f"✅ {count} videos rendered")
+            except KeyboardInterrupt:
+                print("⏹️ Worker stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
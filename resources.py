@@ -0,0 +1,109 @@
+import os
+import math
+
+import benchmark
+
+# Chia CPU của máy cho các job ffmpeg chạy song song để tránh oversubscription
+CPU_CORES_PER_JOB = 4
+# Input 4K (điện thoại) tốn gấp đôi CPU để decode + scale
+HEAVY_INPUT_PIXELS = 3840 * 2160
+HEAVY_CORES_PER_JOB = 8
+HW_ENCODER_SESSIONS = {"nvenc": 3, "qsv": 4, "amf": 3, "mf": 2, "vaapi": 4}
+
+
+def _cgroup_cpu_limit() -> float:
+    """CPU quota of the current cgroup (v2 cpu.max or v1 cfs quota), or None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may really use: affinity mask and container quota, not just os.cpu_count()"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 2
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def is_hardware_codec(codecs: str) -> bool:
+    return bool(codecs) and codecs != "libx264" and codecs.split("_")[-1] in HW_ENCODER_SESSIONS
+
+
+def plan_workers(codecs: str = "libx264", job_count: int = None, heavy_inputs: bool = False) -> int:
+    """Number of parallel renders giving the highest total throughput on this host.
+
+    Order of precedence: RENDER_WORKERS in the environment, the benchmarked
+    best worker count for this host and codec (benchmark.py), then a rule of
+    thumb: CPU encoders get CPU_CORES_PER_JOB cores per job (HEAVY_CORES_PER_JOB
+    when the batch is mostly 4K footage), hardware encoders are capped by
+    concurrent encoder sessions.
+    """
+    cpus = available_cpus()
+    override = os.environ.get("RENDER_WORKERS", "").strip()
+    measured = benchmark.recommended(codecs)
+    if override.isdigit() and int(override) > 0:
+        workers = int(override)
+    elif measured:
+        workers = measured["workers"]
+    elif is_hardware_codec(codecs):
+        workers = min(HW_ENCODER_SESSIONS[codecs.split("_")[-1]], max(1, cpus // 2))
+    else:
+        workers = max(1, cpus // (HEAVY_CORES_PER_JOB if heavy_inputs else CPU_CORES_PER_JOB))
+    if job_count:
+        workers = min(workers, job_count)
+    return max(1, workers)
+
+
+def threads_per_job(workers: int) -> int:
+    """Share of the CPUs each of `workers` concurrent ffmpeg processes gets"""
+    return max(1, available_cpus() // max(1, workers))
+
+
+def apply_thread_budget(cmd: list, threads: int, outputs: list = None) -> list:
+    """Limit one ffmpeg command to about `threads` CPUs.
+
+    The budget is split so the parts add up to about `threads`: half for the
+    encoders (-threads before each output file; libx264 maps it to its own
+    thread count), a quarter for the filters (-filter_threads for -vf/-af and
+    -filter_complex_threads, both global) and the rest shared by the decoders
+    (-threads before every input). Each part gets at least one thread. outputs
+    lists the output paths of a multi-output command (default: the last
+    argument); they share the encoder part.
+    """
+    if not threads:
+        return cmd
+    outputs = set(outputs or [cmd[-1]])
+    inputs = max(1, cmd.count("-i"))
+    encode = max(1, threads // 2)
+    filters = max(1, threads // 4)
+    decode = max(1, threads - encode - filters)
+    per_output = str(max(1, encode // len(outputs)))
+    per_input = str(max(1, decode // inputs))
+    out = [cmd[0], "-filter_threads", str(filters), "-filter_complex_threads", str(filters)]
+    for arg in cmd[1:]:
+        if arg == "-i":
+            out += ["-threads", per_input]
+        elif arg in outputs:
+            out += ["-threads", per_output]
+        out.append(arg)
+    return out
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+import statistics
+from datetime import datetime
+
+# Đo thời gian import và RAM của từng module, mỗi lần trong một process Python mới
+# (giống một worker của ProcessPoolExecutor hay một lần Streamlit chạy lại script)
+STARTUP_RESULTS_PATH = os.environ.get(
+    "STARTUP_RESULTS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_benchmark.json")
+)
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODULES = ["webapp", "video", "tts", "prompt", "script_gemini"]
+
+# Chạy trong process con: in ra JSON {seconds, rss_before, rss_after, error}
+_PROBE_SCRIPT = r"""
+import sys, json, time, importlib
+
+def rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+before = rss()
+start = time.perf_counter()
+error = None
+try:
+    importlib.import_module(sys.argv[1])
+except BaseException as e:
+    error = f"{type(e).__name__}: {e}"
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "rss_before": before, "rss_after": rss(),
+                  "modules": len(sys.modules), "error": error}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    """Import one module in a fresh interpreter; returns its import time and memory"""
+    res = subprocess.run(
+        [sys.executable, "-c", _PROBE_SCRIPT, module],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+    lines = [l for l in res.stdout.splitlines() if l.startswith("{")]
+    if not lines:
+        return {"seconds": None, "rss_before": None, "rss_after": None, "modules": None,
+                "error": (res.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+
+def run_startup_benchmark(modules: list = None, repeat: int = 3, out_path: str = None) -> dict:
+    results = {}
+    for module in modules or DEFAULT_MODULES:
+        runs = [measure_import(module) for _ in range(repeat)]
+        ok = [r for r in runs if not r["error"]]
+        best = min(ok, key=lambda r: r["seconds"]) if ok else runs[-1]
+        rss_mb = None
+        if best["rss_after"] is not None:
+            rss_mb = round(best["rss_after"] / 1024 / 1024, 1)
+        results[module] = {
+            "ok": bool(ok),
+            "error": None if ok else runs[-1]["error"],
+            "import_seconds": round(statistics.median(r["seconds"] for r in ok), 3) if ok else None,
+            "rss_mb": rss_mb,
+            "rss_added_mb": round((best["rss_after"] - best["rss_before"]) / 1024 / 1024, 1)
+            if ok and best["rss_before"] is not None else None,
+            "modules_loaded": best["modules"],
+        }
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version()},
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(out_path or STARTUP_RESULTS_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure import time and memory of the app modules")
+    parser.add_argument("modules", nargs="*", help=f"Modules to import (default: {' '.join(DEFAULT_MODULES)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module (median time)")
+    parser.add_argument("--out", default=STARTUP_RESULTS_PATH, help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    report = run_startup_benchmark(args.modules, args.repeat, args.out)
+    for module, res in report["results"].items():
+        if res["ok"]:
+            print(f"⏱️ {module}: {res['import_seconds']}s, RSS {res['rss_mb']} MB "
+                  f"(+{res['rss_added_mb']} MB, {res['modules_loaded']} modules)")
+        else:
+            print(f"❌ {module}: {res['error']}")
+    print(f"✅ Results saved to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
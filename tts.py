@@ -10,6 +10,8 @@ import soundfile as sf
 from google.cloud import texttospeech
 from google.api_core.exceptions import ResourceExhausted
 
+import probe
+
 def get_audio_duration_sf(audio_path):
     """Get audio duration using soundfile."""
     try:
@@ -17,7 +19,11 @@ def get_audio_duration_sf(audio_path):
         audio_path = str(audio_path)
         if not os.path.exists(audio_path):
             return 0
-            
+
+        duration = probe.get_duration(audio_path)
+        if duration > 0:
+            return duration
+
         with sf.SoundFile(audio_path) as f:
             return f.frames / f.samplerate
     except Exception:
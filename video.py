@@ -1,134 +1,179 @@
 import os
 import shutil
 import subprocess
-import shlex
 import multiprocessing
 import pandas as pd
-import traceback
-import sys
-import platform
-from pathlib import Path
-from moviepy.editor import (
-    VideoFileClip, ImageClip, AudioFileClip,
-    concatenate_videoclips, concatenate_audioclips,
-    CompositeAudioClip, CompositeVideoClip,
-    TextClip, vfx
-)
-import PIL
-import librosa
-import soundfile as sf
+import functools
 import concurrent.futures
-from PIL import ImageFont
+from dataclasses import dataclass, field
 
-# Ensure PIL uses the correct resampling filter if available
-if hasattr(PIL.Image, 'Resampling'):
-    PIL.Image.ANTIALIAS = PIL.Image.Resampling.LANCZOS
+import probe
+import ffmpeg_runner
+import benchmark
+import resources
+import render_control
+import fonts
+from fonts import get_system_font, get_ffmpeg_font_path
+import media_cache
+import render_manifest
+import render_queue
 
 # Video constants
 VIDEO_W, VIDEO_H = 1920, 1080
 AUDIO_END_OFFSET = 0.15
 
-def get_system_font():
-    """Get system font path for different operating systems"""
-    system = platform.system().lower()
-    
-    if system == 'windows':
-        # Windows fonts
-        font_paths = [
-            "C:/Windows/Fonts/arialbd.ttf",
-            "C:/Windows/Fonts/arial.ttf",
-            "C:/Windows/Fonts/calibrib.ttf",
-            "C:/Windows/Fonts/calibri.ttf"
-        ]
-    elif system == 'darwin':  # macOS
-        font_paths = [
-            "/System/Library/Fonts/Arial.ttc",
-            "/System/Library/Fonts/Helvetica.ttc",
-            "/System/Library/Fonts/AppleSDGothicNeo.ttc",
-            "/Library/Fonts/Arial.ttf"
-        ]
-    else:  # Linux and others
-        font_paths = [
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-            "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
-            "/usr/share/fonts/ubuntu/Ubuntu-Bold.ttf",
-            "/usr/share/fonts/truetype/ubuntu/Ubuntu-Bold.ttf"
-        ]
-    
-    # Try to find an existing font
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            return font_path
-    
-    # If no system font found, return None (will use default)
-    return None
-
-def get_ffmpeg_font_path():
-    """Get font path for FFmpeg with proper escaping for different OS"""
-    system = platform.system().lower()
-    
-    if system == 'windows':
-        # Windows - use double backslashes for FFmpeg
-        font_paths = [
-            'C\\:/Windows/Fonts/arialbd.ttf',
-            'C\\:/Windows/Fonts/arial.ttf',
-            'C\\:/Windows/Fonts/calibrib.ttf'
-        ]
-    elif system == 'darwin':  # macOS
-        font_paths = [
-            '/System/Library/Fonts/Arial.ttc',
-            '/System/Library/Fonts/Helvetica.ttc',
-            '/Library/Fonts/Arial.ttf'
-        ]
-    else:  # Linux
-        font_paths = [
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-            '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
-            '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'
-        ]
-    
-    # For Windows, check actual file existence without escape chars
-    if system == 'windows':
-        for i, font_path in enumerate(font_paths):
-            actual_path = font_path.replace('\\:/', ':/')
-            if os.path.exists(actual_path):
-                return font_path
-    else:
-        for font_path in font_paths:
-            if os.path.exists(font_path):
-                return font_path
-    
-    # Fallback to a generic font name
-    return 'Arial' if system == 'windows' else 'DejaVu Sans'
+AUDIO_ENCODE_ARGS = [
+    "-c:a", "aac", "-b:a", "197k", "-ar", "48000", "-ac", "2",
+    "-aac_coder", "twoloop", "-profile:a", "aac_low"
+]
+
+# Draft preview: cùng filter graph, thu nhỏ 540p ở cuối graph, encode nhanh
+DRAFT_FOLDER = "preview"
+DRAFT_W, DRAFT_H = 960, 540
+DRAFT_PRESETS = {"libx264": "ultrafast", "nvenc": "p1", "qsv": "veryfast"}
+DRAFT_AUDIO_ENCODE_ARGS = ["-c:a", "aac", "-b:a", "64k", "-ar", "48000", "-ac", "2"]
+
+# Các định dạng output dựng từ cùng một lần decode/ghép (split trong filter graph).
+# fit: scale (giữ tỉ lệ khung), pad (dọc, giữ nguyên logo/subtitle) hoặc crop (dọc, cắt giữa)
+MAIN_PROFILE = "16x9"
+OUTPUT_PROFILES = {
+    "16x9": {"size": (1920, 1080), "fit": "scale", "suffix": "", "video_args": {}},
+    "9x16": {"size": (1080, 1920), "fit": "pad", "suffix": "_9x16", "video_args": {}},
+    "9x16_crop": {"size": (1080, 1920), "fit": "crop", "suffix": "_9x16_crop", "video_args": {}},
+    "720p": {"size": (1280, 720), "fit": "scale", "suffix": "_720p",
+             "video_args": {"-b:v": "2.5M", "-minrate": "2M", "-maxrate": "6M", "-bufsize": "10M"}},
+}
+
+# Layer cache: body (media + logo) encode gần lossless khi còn phải burn subtitle lên trên
+LAYER_ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "12", "-g", "30",
+                     "-r", "29.97", "-pix_fmt", "yuv420p"]
+
+# Render scheduling
+PROGRESS_POLL_SECONDS = 0.5
+
+# Split-encode: ASIN cuối batch (khi còn ít job hơn worker) được chia thành nhiều
+# đoạn encode song song, ghép lại bằng concat -c copy
+OUTPUT_FPS = 29.97
+SPLIT_MIN_SEGMENT_SECONDS = 10.0
+
+# Ước lượng thời gian render khi lập plan: tốc độ encode (giây video / giây) khi máy
+# chưa chạy benchmark.py, và chi phí decode thêm cho mỗi "1080p" pixel vượt quá 1080p
+DEFAULT_ENCODE_SPEED = {"cpu": 1.0, "hardware": 4.0}
+DRAFT_SPEEDUP = 4.0
+HIGH_RES_DECODE_COST = 0.15
 
 def get_duration(path: str) -> float:
-    """Get duration of media file with cross-platform compatibility"""
-    cmd = [
-        "ffprobe", "-v", "error", "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1", path
+    """Get duration of media file (cached by path, size and mtime in probe.py)"""
+    return probe.get_duration(path)
+
+def default_encoder_preset(codecs: str = "libx264") -> str:
+    """Preset production renders use when none is given"""
+    return "p5" if "nvenc" in codecs else "medium"
+
+def get_video_encode_args(codecs: str = "libx264", preset: str = None) -> list:
+    """Video encoder arguments shared by every render and by the pre-encoded outro"""
+    if not preset:
+        preset = default_encoder_preset(codecs)
+    args = [
+        "-c:v", codecs,
+        "-crf", "18",
+        "-b:v", "5M",
+        "-minrate", "4.5M",
+        "-maxrate", "12M",
+        "-bufsize", "20M",
+        "-r", "29.97",
+        "-preset", preset,
+        "-pix_fmt", "yuv420p",
+        "-colorspace", "bt709",
+        "-color_primaries", "bt709",
+        "-color_trc", "bt709",
+        "-color_range", "tv",
+    ]
+    if codecs == "libx264":
+        # Header không phụ thuộc nội dung để ghép (concat -c copy) với outro
+        args += ["-x264-params", "stitchable=1"]
+    return args
+
+def profile_filter(profile: str) -> str:
+    """Filter turning the composed 1920x1080 timeline into one output profile"""
+    spec = OUTPUT_PROFILES[profile]
+    w, h = spec["size"]
+    if (w, h) == (VIDEO_W, VIDEO_H):
+        return "null"
+    if spec["fit"] == "crop":
+        return f"crop=ih*{w}/{h}:ih,scale={w}:{h},setsar=1"
+    if spec["fit"] == "pad":
+        return f"scale={w}:-2,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+    return f"scale={w}:{h},setsar=1"
+
+def outro_fit(profile: str) -> str:
+    """Outro filter for a profile (None: media_cache's default scale to the output size)"""
+    if profile == MAIN_PROFILE:
+        return None
+    return f"scale={VIDEO_W}:{VIDEO_H},{profile_filter(profile)}"
+
+def get_profile_encode_args(profile: str, codecs: str = "libx264", preset: str = None) -> list:
+    """get_video_encode_args with the profile's bitrate overrides"""
+    args = get_video_encode_args(codecs, preset)
+    for flag, value in OUTPUT_PROFILES[profile]["video_args"].items():
+        if flag in args:
+            args[args.index(flag) + 1] = value
+        else:
+            args += [flag, value]
+    return args
+
+def get_draft_encode_args(codecs: str = "libx264", fps: float = None) -> list:
+    """Fast low-bitrate encoder arguments for 540p review renders"""
+    preset = DRAFT_PRESETS.get(codecs) or DRAFT_PRESETS.get(codecs.split("_")[-1])
+    args = [
+        "-c:v", codecs,
+        "-crf", "28",
+        "-b:v", "1M",
+        "-maxrate", "2M",
+        "-bufsize", "4M",
+        "-r", str(fps or 29.97),
+        "-pix_fmt", "yuv420p",
     ]
-    
-    # Create subprocess with platform-specific settings
-    startupinfo = None
-    if platform.system() == 'Windows':
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        startupinfo.wShowWindow = subprocess.SW_HIDE
-    
+    if preset:
+        args += ["-preset", preset]
+    return args
+
+def concat_copy(paths: list, out_path: str, audio_path: str = None, expected_duration: float = 0.0,
+                should_cancel=None) -> None:
+    """Join files with identical stream layout using the concat demuxer (no re-encode).
+
+    With audio_path, the joined video is muxed with that audio track instead.
+    Runs under the ffmpeg watchdog like a render of expected_duration seconds.
+    """
+    list_path = f"{out_path}.concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in paths:
+            safe = os.path.abspath(p).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{safe}'\n")
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path:
+        cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-shortest"]
+    cmd += ["-c", "copy", "-movflags", "+faststart", out_path]
     try:
-        res = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            check=True,
-            startupinfo=startupinfo,
-            encoding='utf-8',
-            errors='replace'
+        ffmpeg_runner.run_ffmpeg(
+            cmd, expected_duration, label=os.path.basename(out_path),
+            timeout=ffmpeg_runner.render_timeout(expected_duration),
+            stall_timeout=ffmpeg_runner.STALL_SECONDS, should_cancel=should_cancel
         )
-        return float(res.stdout.strip())
-    except (subprocess.CalledProcessError, ValueError, FileNotFoundError):
-        return 0.0
+    finally:
+        os.remove(list_path)
+
+def drawtext_escape(text: str) -> str:
+    """Escape text for drawtext's text= option inside -filter_complex.
+
+    Three levels, innermost first: drawtext's own % expansion, the filter
+    option value (quotes, colons) and the filtergraph (quotes, brackets,
+    commas, semicolons); backslashes are escaped at every level.
+    """
+    text = text.replace("\\", "\\\\").replace("%", "\\%")
+    for specials in ("\\':", "\\'[],;"):
+        text = "".join("\\" + c if c in specials else c for c in text)
+    return text
 
 def calculate_body_duration(media_paths: list, cut_media2: bool) -> float:
     total = 0.0
@@ -142,6 +187,650 @@ def calculate_body_duration(media_paths: list, cut_media2: bool) -> float:
             total += d
     return total
 
+def split_points(duration: float, segments: int) -> list:
+    """Frame numbers where each split-encode segment starts, or [] when not worth splitting"""
+    segments = min(segments or 0, int(duration // SPLIT_MIN_SEGMENT_SECONDS))
+    if segments < 2:
+        return []
+    frames = int(duration * OUTPUT_FPS)
+    return [round(frames * k / segments) for k in range(segments)]
+
+def render_split(asin: str, asin_folder: str, inputs: list, video_fc: list, video_label: str,
+                 audio_fc: list, starts: list, video_duration: float, out_path: str,
+                 codecs: str = "libx264", encoder_preset: str = None,
+                 ffmpeg_threads: int = None, progress_queue=None,
+                 audio_out: str = None, audio_args: list = None) -> None:
+    """Encode the composed timeline as segments in parallel and join them.
+
+    The graph runs once, into a near-lossless intermediate at the output frame
+    rate (the audio is encoded alongside). Each segment then seeks straight to
+    its first frame in that file and encodes a fixed number of frames, so
+    segments start on a keyframe and meet exactly; they are joined with
+    -c copy and the audio is muxed in. With audio_out the audio is written
+    there instead (muxed later, over the outro).
+    """
+    seg_dir = os.path.join(asin_folder, f".{asin}_segments")
+    os.makedirs(seg_dir, exist_ok=True)
+    on_progress = progress_queue.put if progress_queue is not None else None
+    should_cancel = functools.partial(render_control.is_cancelled, asin_folder, asin)
+    timeout = ffmpeg_runner.render_timeout(video_duration)
+
+    def encode(task):
+        cmd, expected, label, threads = task
+        ffmpeg_runner.run_ffmpeg(
+            resources.apply_thread_budget(cmd, threads), expected,
+            on_progress=on_progress, label=label, timeout=timeout,
+            stall_timeout=ffmpeg_runner.STALL_SECONDS, should_cancel=should_cancel
+        )
+
+    def run_parallel(tasks):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks)) as ex:
+            futures = [ex.submit(encode, t) for t in tasks]
+            errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            # Ưu tiên báo lỗi watchdog (huỷ/timeout) hơn lỗi ffmpeg của đoạn khác
+            raise next((e for e in errors if isinstance(e, ffmpeg_runner.RenderAborted)), errors[0])
+
+    # 1. Timeline đã ghép (một lần decode/filter) + audio
+    timeline = os.path.join(seg_dir, "timeline.mp4")
+    tasks = [(["ffmpeg", "-y", "-hwaccel", "auto"] + inputs + [
+        "-filter_complex", ";".join(video_fc + [f"{video_label}fps={OUTPUT_FPS}[vtl]"]),
+        "-map", "[vtl]", "-an"
+    ] + LAYER_ENCODE_ARGS + [timeline], video_duration, f"{asin} [timeline]",
+        ffmpeg_threads * len(starts) if ffmpeg_threads else None)]
+    audio_path = None
+    if audio_fc:
+        audio_path = audio_out or os.path.join(seg_dir, "audio.m4a")
+        tasks.append((["ffmpeg", "-y"] + inputs + [
+            "-filter_complex", ";".join(audio_fc), "-map", "[aout]", "-vn"
+        ] + (audio_args or AUDIO_ENCODE_ARGS + ["-t", f"{video_duration:.3f}"]) + [audio_path],
+            video_duration, f"{asin} [audio]", 1 if ffmpeg_threads else None))
+
+    # 2. Mỗi đoạn seek thẳng tới frame đầu của nó trong timeline
+    seg_paths = []
+    seg_tasks = []
+    bounds = starts + [None]
+    for k, (a, b) in enumerate(zip(bounds, bounds[1:])):
+        seg_path = os.path.join(seg_dir, f"seg{k:03d}.mp4")
+        # Seek nửa frame trước frame a: frame đầu tiên có pts >= điểm seek chính là frame a
+        seek = ["-ss", f"{(a - 0.5) / OUTPUT_FPS:.6f}"] if a else []
+        frames = ["-frames:v", str(b - a)] if b is not None else []
+        cmd = ["ffmpeg", "-y"] + seek + ["-i", timeline, "-map", "0:v", "-an"] + frames + \
+            get_video_encode_args(codecs, encoder_preset) + [seg_path]
+        expected = ((b if b is not None else video_duration * OUTPUT_FPS) - a) / OUTPUT_FPS
+        seg_tasks.append((cmd, expected, f"{asin} [{k + 1}/{len(starts)}]", ffmpeg_threads))
+        seg_paths.append(seg_path)
+
+    try:
+        run_parallel(tasks)
+        run_parallel(seg_tasks)
+        concat_copy(seg_paths, out_path, None if audio_out else audio_path, video_duration, should_cancel)
+    finally:
+        shutil.rmtree(seg_dir, ignore_errors=True)
+
+@dataclass
+class RenderOutput:
+    """One output file of a render: its graph labels, encoder arguments and outro"""
+    profile: str
+    out_path: str
+    render_path: str
+    video_label: str
+    audio_label: str = None
+    output_args: list = field(default_factory=list)
+    outtro_clip: str = None
+
+@dataclass
+class RenderPlan:
+    """Everything one ASIN render will run, built from probe data without encoding anything"""
+    asin: str
+    inputs: list = field(default_factory=list)
+    video_fc: list = field(default_factory=list)
+    video_label: str = "[vbody]"
+    output_fc: list = field(default_factory=list)
+    audio_fc: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    # Outro encode sẵn: audio mix là một output riêng, ghép khi nối outro
+    audio_path: str = None
+    audio_args: list = field(default_factory=list)
+    video_duration: float = 0.0
+    expected_duration: float = 0.0
+    estimated_seconds: float = 0.0
+    problems: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)
+    # Các thành phần của graph (media, logo, subtitle, audio) để render theo layer
+    layers: dict = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    @property
+    def out_path(self) -> str:
+        """Output of the first profile, reported as the ASIN's video"""
+        return self.outputs[0].out_path if self.outputs else None
+
+    @property
+    def graph(self) -> str:
+        return ";".join(self.video_fc + self.output_fc + self.audio_fc)
+
+    @property
+    def cmd(self) -> list:
+        cmd = ["ffmpeg", "-y", "-hwaccel", "auto"] + self.inputs + ["-filter_complex", self.graph]
+        for out in self.outputs:
+            cmd += ["-map", out.video_label]
+            if out.audio_label:
+                cmd += ["-map", out.audio_label]
+            cmd += out.output_args + [out.render_path]
+        if self.audio_path:
+            cmd += ["-map", "[aout]"] + self.audio_args + [self.audio_path]
+        return cmd
+
+    def summary(self) -> str:
+        status = "🧮" if self.ok else "❌"
+        text = (f"{status} [{self.asin}] {self.inputs.count('-i')} inputs, {self.expected_duration:.1f}s video, "
+                f"~{self.estimated_seconds:.0f}s to render")
+        for msg in self.problems + self.warnings:
+            text += f"\n   • {msg}"
+        return text
+
+def audio_graph(chains: list) -> list:
+    """Filter lines mixing (input index, filter chain, label) audio sources into [aout]"""
+    fc = [f"[{idx}:a]{chain}{label}" for idx, chain, label in chains]
+    if chains:
+        fc.append(f"{''.join(label for *_, label in chains)}amix=inputs={len(chains)}:duration=first[aout]")
+    return fc
+
+def attach_subtitle(video_path: str, sub_text: str, subtitle_mode: str = "track") -> str:
+    """Write the subtitle as an SRT next to the video; in "track" mode also mux it as a
+    mov_text stream (stream copy, replacing any previous subtitle track).
+
+    An empty sub_text removes the SRT and the track. Returns the SRT path, or None.
+    """
+    srt_path = os.path.splitext(video_path)[0] + ".srt"
+    if sub_text:
+        import sub  # sub.py kéo theo google.generativeai, chỉ import khi cần
+        sub.write_srt(sub_text, srt_path, get_duration(video_path))
+    elif os.path.exists(srt_path):
+        os.remove(srt_path)
+    if subtitle_mode == "track":
+        tmp = f"{video_path}.sub.mp4"
+        cmd = ["ffmpeg", "-y", "-i", video_path]
+        if sub_text:
+            cmd += ["-i", srt_path, "-map", "0:v", "-map", "0:a?", "-map", "1:s", "-c", "copy",
+                    "-c:s", "mov_text", "-metadata:s:s:0", "language=eng"]
+        else:
+            cmd += ["-map", "0:v", "-map", "0:a?", "-c", "copy"]
+        try:
+            ffmpeg_runner.run_ffmpeg(cmd + ["-movflags", "+faststart", tmp], label=os.path.basename(video_path),
+                                     timeout=ffmpeg_runner.render_timeout(0),
+                                     stall_timeout=ffmpeg_runner.STALL_SECONDS)
+            os.replace(tmp, video_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return srt_path if sub_text else None
+
+def output_paths(params: dict) -> list:
+    """Every file one job (create_video params) writes, main profile first"""
+    profiles = [MAIN_PROFILE] if params.get("draft") else list(params.get("output_profiles") or [MAIN_PROFILE])
+    return [os.path.join(params["asin_folder"], f"{params['asin']}{OUTPUT_PROFILES[p]['suffix']}.mp4")
+            for p in profiles]
+
+def update_soft_subtitles(params: dict) -> None:
+    """Refresh the soft subtitle of every rendered output of one job (create_video params)"""
+    for path in output_paths(params):
+        if not os.path.exists(path):
+            continue
+        attach_subtitle(path, params.get("sub_text"), params["subtitle_mode"])
+
+def render_layered(plan: RenderPlan, asin_folder: str, render_path: str, codecs: str = "libx264",
+                   encoder_preset: str = None, ffmpeg_threads: int = None, progress_queue=None) -> None:
+    """Render through cached layers: video body (media), subtitle + logo overlay, audio mux.
+
+    Each video layer is cached by the content of its inputs, its graph and its
+    encoder arguments, so a new voice only reruns the -c:v copy mux and an
+    edited subtitle only reruns the overlay on the cached body. The logo is
+    drawn over the subtitle, in the same order as the single-pass graph.
+    Without a subtitle the logo goes straight into the body layer.
+    """
+    layers = plan.layers
+    final_args = get_video_encode_args(codecs, encoder_preset)
+    subtitle = layers.get("subtitle")
+
+    def run(stage, cmd, expected):
+        ffmpeg_runner.run_ffmpeg(
+            resources.apply_thread_budget(cmd, ffmpeg_threads), expected,
+            on_progress=progress_queue.put if progress_queue is not None else None,
+            label=f"{plan.asin} [{stage}]",
+            timeout=ffmpeg_runner.render_timeout(expected),
+            stall_timeout=ffmpeg_runner.STALL_SECONDS,
+            should_cancel=functools.partial(render_control.is_cancelled, asin_folder, plan.asin)
+        )
+
+    logo = layers.get("logo")
+
+    def add_logo(inputs, fc, last):
+        # Logo vẽ sau cùng (đè lên phụ đề) như graph một lượt
+        if not logo:
+            return last
+        logo_in = f"[{inputs.count('-i')}:v]"
+        inputs += ["-i", logo["input"]]
+        if logo["scale_w"]:
+            fc.append(f"{logo_in}scale={logo['scale_w']}:-1[logo_s]")
+            logo_in = "[logo_s]"
+        fc.append(f"{last}{logo_in}{logo['filter']}[vlogo]")
+        return "[vlogo]"
+
+    # Layer 1: media đã ghép (+ logo khi không có phụ đề)
+    inputs, fc, labels = [], [], []
+    for k, (args, path, filt) in enumerate(layers["media"]):
+        inputs += args + ["-i", path]
+        fc.append(f"[{k}:v]{filt}[v{k}]")
+        labels.append(f"[v{k}]")
+    fc.append(f"{''.join(labels)}concat=n={len(labels)}:v=1:a=0[vbody]")
+    last = "[vbody]"
+    if not subtitle:
+        last = add_logo(inputs, fc, last)
+    body_args = LAYER_ENCODE_ARGS if subtitle else final_args
+    body_key = ([(args, media_cache.input_key(path)) for args, path, _ in layers["media"]],
+                media_cache.input_key(logo["input"]) if logo and not subtitle else None, fc, body_args)
+    video = media_cache.cached_layer("body", body_key, lambda tmp: run("body", [
+        "ffmpeg", "-y", "-hwaccel", "auto"] + inputs + [
+        "-filter_complex", ";".join(fc), "-map", last, "-an"] + body_args + ["-f", "mp4", tmp
+    ], plan.video_duration))
+
+    # Layer 2: burn subtitle rồi logo lên body đã cache
+    if subtitle:
+        inputs = ["-i", video] + (["-i", subtitle["input"]] if subtitle["input"] else [])
+        fc = [f"[0:v][1:v]{subtitle['filter']}[vsub]" if subtitle["input"] else f"[0:v]{subtitle['filter']}[vsub]"]
+        last = add_logo(inputs, fc, "[vsub]")
+        sub_key = (media_cache.input_key(video), media_cache.input_key(subtitle["input"]),
+                   media_cache.input_key(logo["input"]) if logo else None, fc, final_args)
+        video = media_cache.cached_layer("subtitle", sub_key, lambda tmp: run("subtitle", [
+            "ffmpeg", "-y"] + inputs + [
+            "-filter_complex", ";".join(fc), "-map", last, "-an"] + final_args + ["-f", "mp4", tmp
+        ], plan.video_duration))
+
+    # Layer 3: ghép audio, giữ nguyên video (-c:v copy)
+    inputs = ["-i", video]
+    for args, path, _ in layers["audio"]:
+        inputs += args + ["-i", path]
+    cmd = ["ffmpeg", "-y"] + inputs
+    chains = [(k + 1, chain, f"[a{k}]") for k, (*_, chain) in enumerate(layers["audio"])]
+    if plan.audio_path:
+        # Outro encode sẵn: audio encode riêng, mux khi nối outro (create_video)
+        run("audio", cmd + ["-filter_complex", ";".join(audio_graph(chains)), "-map", "[aout]"]
+            + plan.audio_args + [plan.audio_path], plan.expected_duration)
+        shutil.copyfile(video, render_path)
+        return
+    if chains:
+        cmd += ["-filter_complex", ";".join(audio_graph(chains)), "-map", "0:v", "-map", "[aout]"] + AUDIO_ENCODE_ARGS
+    else:
+        cmd += ["-map", "0:v"]
+    run("mux", cmd + ["-c:v", "copy", "-movflags", "+faststart", "-shortest", render_path], plan.expected_duration)
+
+def encode_speed(codecs: str = "libx264", draft: bool = False) -> float:
+    """Seconds of 1080p video one render job encodes per second, from benchmark.py results if any"""
+    measured = benchmark.recommended(codecs)
+    if measured and measured.get("fps") and measured.get("workers"):
+        speed = measured["fps"] / measured["workers"] / OUTPUT_FPS
+    else:
+        speed = DEFAULT_ENCODE_SPEED["hardware" if resources.is_hardware_codec(codecs) else "cpu"]
+    return speed * (DRAFT_SPEEDUP if draft else 1.0)
+
+def estimate_render_seconds(infos: list, expected_duration: float, codecs: str = "libx264",
+                            draft: bool = False) -> float:
+    """Encode time at the measured speed, plus extra decode/scale time for inputs above 1080p"""
+    seconds = expected_duration / max(encode_speed(codecs, draft), 0.01)
+    total = sum(i.duration for i in infos if i) or 1.0
+    extra = sum(i.duration * max(0.0, i.width * i.height / (VIDEO_W * VIDEO_H) - 1) for i in infos if i)
+    return seconds * (1 + HIGH_RES_DECODE_COST * extra / total)
+
+def estimate_batch_seconds(costs: list, workers: int) -> float:
+    """Wall time of a batch when jobs start longest-first on the least busy worker"""
+    loads = [0.0] * max(1, workers)
+    for cost in sorted(costs, reverse=True):
+        loads[loads.index(min(loads))] += cost
+    return max(loads)
+
+def plan_video(
+    asin: str,
+    media_paths: list,
+    audio1: str = None,
+    audio2: str = None,
+    logo_path: str = None,
+    asin_folder: str = ".",
+    logo_scale_percent: int = 15,
+    logo_x: int = 50,
+    logo_y: int = 50,
+    brand: str = "Canamax",
+    bluestars_outtro_path: str = None,
+    codecs: str = "libx264",
+    cut_media2: bool = True,
+    audio1_volume: float = 0.1,
+    audio2_volume: float = 1.0,
+    sub_text: str = None,
+    subtitle_align: str = "center",
+    subtitle_y: int = 100,
+    subtitle_fontsize: int = 85,
+    subtitle_fontcolor: str = "#000000",
+    subtitle_borderw: int = 2,
+    subtitle_bordercolor: str = "#FFFFFF",
+    subtitle_margin: int = 100,
+    subtitle_min_fontsize: int = 30,
+    subtitle_mode: str = "drawtext",
+    use_clip_cache: bool = True,
+    encoder_preset: str = None,
+    draft: bool = False,
+    draft_fps: float = None,
+    output_profiles: list = None,
+    ffmpeg_threads: int = None,
+    dry_run: bool = False,
+    **_
+) -> RenderPlan:
+    """Build the ffmpeg inputs, filter graph and output arguments of one ASIN.
+
+    With dry_run, cached intermediates (normalized clips, encoded outro) are
+    only looked up, never encoded, so a whole batch can be planned in seconds.
+    Drafts also only look up normalized clips and otherwise filter the source
+    directly in their graph.
+    Problems that would make ffmpeg fail are collected in plan.problems.
+    Every profile in output_profiles (default: 16x9 only) is an extra output
+    of the same ffmpeg process; the first one is the ASIN's main video.
+    Cache encodes run inside the job's ffmpeg_threads budget.
+    """
+    plan = RenderPlan(asin=asin)
+    should_cancel = functools.partial(render_control.is_cancelled, asin_folder, asin)
+    # Draft chỉ xem trước bố cục của bản chính
+    profiles = [MAIN_PROFILE] if draft else list(output_profiles or [MAIN_PROFILE])
+    for profile in profiles:
+        if profile not in OUTPUT_PROFILES:
+            plan.problems.append(f"unknown output profile: {profile}")
+
+    if not media_paths:
+        plan.problems.append("no media")
+    for p in media_paths:
+        if not os.path.exists(str(p)):
+            plan.problems.append(f"media not found: {p}")
+    for label, path in (("Audio1", audio1), ("Audio2", audio2), ("logo", logo_path),
+                        ("outro", bluestars_outtro_path)):
+        if path and not os.path.exists(path):
+            plan.warnings.append(f"{label} not found, skipped: {path}")
+    if plan.problems:
+        return plan
+
+    # Audio2 được cắt ngay trong filter graph (atrim), không cần file WAV tạm
+    audio2_trim = None
+    if audio2 and os.path.exists(audio2):
+        body_dur = calculate_body_duration(media_paths, cut_media2)
+        t = max(body_dur - 0.1, 0.0)  # ⭐ GIỮ NGUYÊN: vẫn trừ 0.1s
+        # Nhưng đảm bảo không vượt quá 44.8s
+        audio2_trim = min(t, 44.8)  # ⭐ THÊM: giới hạn tối đa 44.8s
+
+    # Filter riêng cho từng media (cắt giữa Media2, tăng tốc Media3, scale)
+    media_infos = []
+    media_inputs = []
+    media_filters = []
+    for i, p in enumerate(media_paths):
+        info = probe.probe_media(p)
+        media_infos.append(info)
+        d = info.duration if info else 0.0
+        if d <= 0:
+            plan.problems.append(f"media has no readable duration: {p}")
+        input_args = []
+        filters = []
+        speed = None
+        if i == 0 and cut_media2 and d >= 9:
+            start = (d - 9) / 2
+            if info.can_seek(start, 9):
+                # Seek trên input: chỉ giải mã từ keyframe gần điểm cắt, không từ frame 0
+                input_args = ["-accurate_seek", "-ss", f"{start:.3f}", "-t", "9"]
+                filters.append("setpts=PTS-STARTPTS")
+            else:
+                filters.append(f"trim=start={start}:end={start+9},setpts=PTS-STARTPTS")
+            speed = 9 / 5
+            filters.append("setpts=PTS/(9/5)")
+        elif i == 1 and d > 31.9:  # ⭐ THAY ĐỔI: 32 -> 31.9 để video ngắn hơn
+            speed = d / 31.9  # ⭐ THAY ĐỔI: chia cho 31.9 thay vì 32
+            filters.append(f"setpts=PTS/{speed:.6f}")
+        # Bỏ frame thừa trước khi scale (clip tăng tốc hoặc quay > 30fps)
+        if speed or (info and info.fps > OUTPUT_FPS + 0.01):
+            filters.append(f"fps={OUTPUT_FPS}")
+        # Bỏ qua scale khi input đã đúng 1920x1080 yuv420p
+        if not (info and info.matches(VIDEO_W, VIDEO_H)):
+            filters.append(f"scale={VIDEO_W}:{VIDEO_H}")
+        filt = ",".join(filters) or "null"
+
+        # Dùng clip trung gian đã chuẩn hoá (bỏ qua nếu nguồn đã đúng chuẩn).
+        # Draft chỉ dùng clip đã có sẵn: encode mezzanine full-res còn lâu hơn chính bản draft
+        already_normalized = filt == "null" and info and abs(info.fps - 29.97) < 0.01
+        cached = None
+        if use_clip_cache and not already_normalized and d > 0:
+            cached = media_cache.normalized_clip(p, filt, input_args, create=not (dry_run or draft),
+                                                 should_cancel=should_cancel, threads=ffmpeg_threads)
+        if cached:
+            media_inputs.append(([], cached))
+            media_filters.append("null")
+        else:
+            media_inputs.append((input_args, p))
+            media_filters.append(filt)
+
+    # Outro được encode sẵn một lần cho mỗi profile và nối bằng concat -c copy;
+    # thiếu bản nào thì cả graph dùng outro trong graph
+    outro_clips = {}
+    if bluestars_outtro_path and os.path.exists(bluestars_outtro_path) and not draft:
+        for profile in profiles:
+            w, h = OUTPUT_PROFILES[profile]["size"]
+            outro_clips[profile] = media_cache.encoded_outro(
+                bluestars_outtro_path, get_profile_encode_args(profile, codecs, encoder_preset),
+                w, h, create=not dry_run, fit=outro_fit(profile), should_cancel=should_cancel,
+                threads=ffmpeg_threads
+            )
+        if not all(outro_clips.values()):
+            outro_clips = {}
+
+    # Subtitle: cỡ chữ vừa khung; chế độ "image" dùng PNG dựng sẵn thay cho drawtext.
+    # Phụ đề mềm (srt/track) không burn vào hình, create_video ghép sau khi render
+    sub_overlay = None
+    if subtitle_mode in render_manifest.SOFT_SUBTITLE_MODES:
+        sub_text = None
+    if sub_text:
+        max_text_width = VIDEO_W - (2 * subtitle_margin)
+        final_fontsize = fonts.fit_font_size(
+            sub_text, get_system_font(), max_text_width,
+            subtitle_fontsize, subtitle_min_fontsize
+        )
+        if subtitle_mode == "image":
+            sub_overlay = media_cache.subtitle_image(
+                sub_text, get_system_font(), final_fontsize, subtitle_fontcolor,
+                subtitle_borderw, subtitle_bordercolor, subtitle_align,
+                subtitle_y, subtitle_margin, VIDEO_W
+            )
+
+    inputs = []
+    idx_map = {"media": []}
+    cur = 0
+
+    for args, p in media_inputs:
+        inputs += args + ["-i", p]
+        idx_map["media"].append(cur)
+        cur += 1
+    plan.layers["media"] = [(args, p, filt) for (args, p), filt in zip(media_inputs, media_filters)]
+    if bluestars_outtro_path and os.path.exists(bluestars_outtro_path) and not outro_clips:
+        inputs += ["-t", "3", "-i", bluestars_outtro_path]
+        idx_map["outtro"] = cur
+        cur += 1
+    logo_w = int(VIDEO_W * logo_scale_percent / 100)
+    logo_scaled = None
+    if logo_path and os.path.exists(logo_path):
+        # Logo đã resize sẵn (dùng chung cho cả batch), fallback scale trong graph
+        logo_scaled = media_cache.scaled_logo(logo_path, logo_w)
+        inputs += ["-i", logo_scaled or logo_path]
+        idx_map["logo"] = cur
+        cur += 1
+    if sub_overlay:
+        inputs += ["-i", sub_overlay[0]]
+        idx_map["subtitle"] = cur
+        cur += 1
+    if audio2 and os.path.exists(audio2):
+        inputs += ["-i", audio2]
+        idx_map["audio2"] = cur
+        cur += 1
+    audio1_args, audio1_chain = [], f"volume={audio1_volume}"
+    if audio1 and os.path.exists(audio1):
+        # Nhạc nền decode sẵn (lặp + volume) dùng chung cả batch, chỉ đọc đoạn cần dùng;
+        # fallback: lặp file gốc ngay trong graph
+        music_seconds = calculate_body_duration(media_paths, cut_media2) + media_cache.OUTRO_DURATION
+        music = media_cache.decoded_music(audio1, audio1_volume, music_seconds, create=not dry_run,
+                                          should_cancel=should_cancel, threads=ffmpeg_threads)
+        if music:
+            audio1_args, audio1_chain = ["-t", f"{music_seconds:.3f}"], "anull"
+        else:
+            audio1_args = ["-stream_loop", "-1"]
+        audio1 = music or audio1
+        inputs += audio1_args + ["-i", audio1]
+        idx_map["audio1"] = cur
+        cur += 1
+
+    fc = []
+    vlabels = []
+
+    for i, filt in enumerate(media_filters):
+        in_v = f"[{idx_map['media'][i]}:v]"
+        out_v = f"[v{i}]"
+        fc.append(f"{in_v}{filt}{out_v}")
+        vlabels.append(out_v)
+
+    n = len(vlabels)
+    fc.append(f"{''.join(vlabels)}concat=n={n}:v=1:a=0[vbody]")
+    last = "[vbody]"
+
+    if "subtitle" in idx_map:
+        sub_x, sub_y = sub_overlay[1], sub_overlay[2]
+        fc.append(f"{last}[{idx_map['subtitle']}:v]overlay={sub_x}:{sub_y}[vsub]")
+        last = "[vsub]"
+        plan.layers["subtitle"] = {"input": sub_overlay[0], "filter": f"overlay={sub_x}:{sub_y}"}
+    elif sub_text:
+        txt = drawtext_escape(sub_text)
+
+        if subtitle_align == 'center':
+             x_expr = "(w-text_w)/2"
+        elif subtitle_align == 'left':
+            x_expr = str(subtitle_margin)
+        else:
+            x_expr = f"w-text_w-{subtitle_margin}"
+
+        ffmpeg_font = get_ffmpeg_font_path()
+
+        draw = (
+            f"drawtext=fontfile='{ffmpeg_font}'"
+            f":text={txt}"
+            f":x={x_expr}:y={subtitle_y}"
+            f":fontsize={final_fontsize}"
+            f":fontcolor={subtitle_fontcolor}"
+            f":borderw={subtitle_borderw}:bordercolor={subtitle_bordercolor}"
+        )
+        fc.append(f"{last}{draw}[vsub]")
+        last = "[vsub]"
+        plan.layers["subtitle"] = {"input": None, "filter": draw}
+
+    if "logo" in idx_map:
+        logo_idx = idx_map["logo"]
+        if logo_scaled:
+            logo_in = f"[{logo_idx}:v]"
+        else:
+            fc.append(f"[{logo_idx}:v]scale={logo_w}:-1[logo_s]")
+            logo_in = "[logo_s]"
+        x = f"W-w-{logo_x}" if brand == "BlueStars" else str(logo_x)
+        fc.append(f"{last}{logo_in}overlay={x}:{logo_y}[vlogo]")
+        last = "[vlogo]"
+        plan.layers["logo"] = {"input": logo_scaled or logo_path, "scale_w": None if logo_scaled else logo_w,
+                               "filter": f"overlay={x}:{logo_y}"}
+    plan.layers["outro_in_graph"] = "outtro" in idx_map
+    if "outtro" in idx_map:
+        fc.append(f"[{idx_map['outtro']}:v]setpts=PTS-STARTPTS[outtro_norm]")
+        fc.append(f"{last}[outtro_norm]concat=n=2:v=1:a=0[vfinal]")
+        last = "[vfinal]"
+    if draft:
+        # Thu nhỏ sau khi đã ghép xong để bố cục giống hệt bản final
+        draft_filter = f"scale={DRAFT_W}:{DRAFT_H}"
+        if draft_fps:
+            draft_filter += f",fps={draft_fps}"
+        fc.append(f"{last}{draft_filter}[vdraft]")
+        last = "[vdraft]"
+    plan.inputs, plan.video_fc, plan.video_label = inputs, fc, last
+
+    audio_chains = []
+    if "audio2" in idx_map:
+        a2_filter = f"atrim=end={audio2_trim:.3f},asetpts=PTS-STARTPTS," if audio2_trim is not None else ""
+        audio_chains.append(([], audio2, idx_map["audio2"], f"{a2_filter}volume={audio2_volume}", "[a2v]"))
+    if "audio1" in idx_map:
+        audio_chains.append((audio1_args, audio1, idx_map["audio1"], audio1_chain, "[a1v]"))
+    plan.layers["audio"] = [(args, path, chain) for args, path, _, chain, _ in audio_chains]
+    audio_fc = audio_graph([(idx, chain, label) for *_, idx, chain, label in audio_chains])
+    audio_labels = [label for *_, label in audio_chains]
+    plan.audio_fc = audio_fc
+
+    # Outro encode sẵn: output chỉ có hình; audio mix encode một lần, dài tới hết outro,
+    # và được mux khi nối outro để voice/nhạc vẫn chạy trên outro như bản draft
+    body_duration = calculate_body_duration(media_paths, cut_media2)
+    if outro_clips and audio_labels:
+        plan.audio_path = os.path.join(asin_folder, f"{asin}_audio.m4a")
+        plan.audio_args = AUDIO_ENCODE_ARGS + ["-t", f"{body_duration + media_cache.OUTRO_DURATION:.3f}"]
+
+    # Mỗi profile một output: split timeline đã ghép (và audio) thay vì decode lại
+    video_labels = [last]
+    audio_out = ["[aout]"] if audio_labels and not plan.audio_path else [None]
+    if len(profiles) > 1:
+        video_labels = [f"[vo{k}]" for k in range(len(profiles))]
+        plan.output_fc.append(f"{last}split={len(profiles)}{''.join(video_labels)}")
+        if audio_labels and not plan.audio_path:
+            audio_fc[-1] = audio_fc[-1].replace("[aout]", "[amixed]")
+            audio_out = [f"[ao{k}]" for k in range(len(profiles))]
+            audio_fc.append(f"[amixed]asplit={len(profiles)}{''.join(audio_out)}")
+        else:
+            audio_out = [None] * len(profiles)
+    for k, profile in enumerate(profiles):
+        label = video_labels[k]
+        filt = profile_filter(profile)
+        if filt != "null":
+            plan.output_fc.append(f"{label}{filt}[vp{k}]")
+            label = f"[vp{k}]"
+        output_args = []
+        if audio_out[k]:
+            output_args += DRAFT_AUDIO_ENCODE_ARGS if draft else AUDIO_ENCODE_ARGS
+        if draft:
+            output_args += get_draft_encode_args(codecs, draft_fps)
+        else:
+            output_args += get_profile_encode_args(profile, codecs, encoder_preset)
+        suffix = OUTPUT_PROFILES[profile]["suffix"]
+        out_path = os.path.join(asin_folder, f"{asin}{suffix}.mp4")
+        clip = outro_clips.get(profile)
+        plan.outputs.append(RenderOutput(
+            profile=profile, out_path=out_path,
+            render_path=os.path.join(asin_folder, f"{asin}{suffix}_body.mp4") if clip else out_path,
+            video_label=label, audio_label=audio_out[k],
+            output_args=output_args + ["-movflags", "+faststart"] + ([] if clip else ["-shortest"]),
+            outtro_clip=clip
+        ))
+
+    # Thời lượng dự kiến để tính % và ETA (-shortest cắt theo voice nếu voice ngắn hơn)
+    video_duration = body_duration
+    if "outtro" in idx_map:
+        video_duration += 3
+    expected_duration = video_duration
+    if audio2_trim is not None:
+        expected_duration = min(expected_duration, audio2_trim, get_duration(audio2) or audio2_trim)
+    plan.video_duration, plan.expected_duration = video_duration, expected_duration
+    if expected_duration <= 0:
+        plan.problems.append("expected output duration is zero")
+    plan.estimated_seconds = estimate_render_seconds(media_infos, expected_duration, codecs, draft)
+    # Mỗi profile thêm tốn thêm khoảng một lần encode (theo số pixel), không thêm decode
+    for profile in profiles[1:]:
+        w, h = OUTPUT_PROFILES[profile]["size"]
+        plan.estimated_seconds += expected_duration / encode_speed(codecs) * w * h / (VIDEO_W * VIDEO_H)
+    return plan
+
 def create_video(
     asin: str,
     media_paths: list,
@@ -166,208 +855,95 @@ def create_video(
     subtitle_borderw: int = 2,
     subtitle_bordercolor: str = "#FFFFFF",
     subtitle_margin: int = 100,
-    subtitle_min_fontsize: int = 30
+    subtitle_min_fontsize: int = 30,
+    subtitle_mode: str = "drawtext",
+    use_clip_cache: bool = True,
+    encoder_preset: str = None,
+    draft: bool = False,
+    draft_fps: float = None,
+    output_profiles: list = None,
+    layer_cache: bool = False,
+    ffmpeg_threads: int = None,
+    split_segments: int = None,
+    progress_queue=None
 ) -> str:
     try:
         os.makedirs(asin_folder, exist_ok=True)
-        out_path = os.path.join(asin_folder, f"{asin}.mp4")
-
-        # Sửa trong hàm create_video, phần trim audio2:
-        if audio2 and os.path.exists(audio2):
-            body_dur = calculate_body_duration(media_paths, cut_media2)
-            t = max(body_dur - 0.1, 0.0)  # ⭐ GIỮ NGUYÊN: vẫn trừ 0.1s
-            # Nhưng đảm bảo không vượt quá 44.8s
-            t = min(t, 44.8)  # ⭐ THÊM: giới hạn tối đa 44.8s
-            a2_trim = os.path.join(asin_folder, f"{asin}_a2.wav")
-            startupinfo = None
-            if platform.system() == 'Windows':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            subprocess.run(
-                ["ffmpeg", "-y", "-i", audio2, "-t", f"{t:.3f}", a2_trim],
-                check=True, 
-                capture_output=True, 
-                text=True,
-                startupinfo=startupinfo,
-                encoding='utf-8',
-                errors='replace'
-            )
-            audio2 = a2_trim
-
-        inputs = []
-        idx_map = {"media": []}
-        cur = 0
-
-        for p in media_paths:
-            inputs += ["-i", p]
-            idx_map["media"].append(cur)
-            cur += 1
-        if bluestars_outtro_path and os.path.exists(bluestars_outtro_path):
-            inputs += ["-t", "3", "-i", bluestars_outtro_path]
-            idx_map["outtro"] = cur
-            cur += 1
-        if logo_path and os.path.exists(logo_path):
-            inputs += ["-i", logo_path]
-            idx_map["logo"] = cur
-            cur += 1
-        if audio2 and os.path.exists(audio2):
-            inputs += ["-i", audio2]
-            idx_map["audio2"] = cur
-            cur += 1
-        if audio1 and os.path.exists(audio1):
-            inputs += ["-i", audio1]
-            idx_map["audio1"] = cur
-            cur += 1
-        
-        fc = []
-        vlabels = []
-
-        # Sửa phần xử lý video media thứ 2:
-        for i, p in enumerate(media_paths):
-            in_v = f"[{idx_map['media'][i]}:v]"
-            out_v = f"[v{i}]"
-            d = get_duration(p)
-            filt = f"scale={VIDEO_W}:{VIDEO_H}"
-            if i == 0 and cut_media2 and d >= 9:
-                start = (d - 9) / 2
-                filt += (f",trim=start={start}:end={start+9},"
-                         "setpts=PTS-STARTPTS,setpts=PTS/(9/5)")
-            elif i == 1 and d > 31.9:  # ⭐ THAY ĐỔI: 32 -> 31.9 để video ngắn hơn
-                speed = d / 31.9  # ⭐ THAY ĐỔI: chia cho 31.9 thay vì 32
-                filt += f",setpts=PTS/{speed:.6f}"
-            fc.append(f"{in_v}{filt}{out_v}")
-            vlabels.append(out_v)
-
-        n = len(vlabels)
-        fc.append(f"{''.join(vlabels)}concat=n={n}:v=1:a=0[vbody]")
-        last = "[vbody]"
+        if render_control.is_cancelled(asin_folder, asin):
+            return f"❌ [{asin}] cancelled before start"
 
-        if sub_text:
-            final_fontsize = subtitle_fontsize
-            max_text_width = VIDEO_W - (2 * subtitle_margin)
-            
-            system_font = get_system_font()
-            try:
-                if system_font:
-                    font = ImageFont.truetype(system_font, size=final_fontsize)
-                else:
-                    font = ImageFont.load_default()
-
-                while final_fontsize > subtitle_min_fontsize:
-                    try:
-                        if system_font:
-                            font = ImageFont.truetype(system_font, size=final_fontsize)
-                        text_width = font.getlength(sub_text) if hasattr(font, 'getlength') else font.getsize(sub_text)[0]
-                        if text_width <= max_text_width:
-                            break
-                    except:
-                        break
-                    final_fontsize -= 1
-            except (IOError, OSError):
-                final_fontsize = subtitle_fontsize
-                try:
-                    font = ImageFont.load_default()
-                except:
-                    pass
-
-            txt = sub_text.replace("'", r"'").replace(":", r"\:").replace("%", r"\%")
-            
-            if subtitle_align == 'center':
-                 x_expr = "(w-text_w)/2"
-            elif subtitle_align == 'left':
-                x_expr = str(subtitle_margin)
+        plan = plan_video(
+            asin, media_paths, audio1=audio1, audio2=audio2, logo_path=logo_path,
+            asin_folder=asin_folder, logo_scale_percent=logo_scale_percent,
+            logo_x=logo_x, logo_y=logo_y, brand=brand,
+            bluestars_outtro_path=bluestars_outtro_path, codecs=codecs, cut_media2=cut_media2,
+            audio1_volume=audio1_volume, audio2_volume=audio2_volume, sub_text=sub_text,
+            subtitle_align=subtitle_align, subtitle_y=subtitle_y,
+            subtitle_fontsize=subtitle_fontsize, subtitle_fontcolor=subtitle_fontcolor,
+            subtitle_borderw=subtitle_borderw, subtitle_bordercolor=subtitle_bordercolor,
+            subtitle_margin=subtitle_margin, subtitle_min_fontsize=subtitle_min_fontsize,
+            subtitle_mode=subtitle_mode, use_clip_cache=use_clip_cache,
+            encoder_preset=encoder_preset, draft=draft, draft_fps=draft_fps,
+            output_profiles=output_profiles, ffmpeg_threads=ffmpeg_threads
+        )
+        if not plan.ok:
+            return f"❌ [{asin}] invalid render plan: {'; '.join(plan.problems)}"
+        render_paths = [out.render_path for out in plan.outputs]
+        should_cancel = functools.partial(render_control.is_cancelled, asin_folder, asin)
+        # Body render (trước khi nối outro) và audio riêng: luôn xoá; output chỉ xoá khi lỗi
+        temp_paths = [out.render_path for out in plan.outputs if out.render_path != out.out_path]
+        temp_paths += [plan.audio_path] if plan.audio_path else []
+        finished = False
+
+        # Chỉ chia đoạn với encoder CPU và một output 16:9; encoder phần cứng bị giới hạn số session
+        split_starts = []
+        single_main = len(plan.outputs) == 1 and plan.outputs[0].profile == MAIN_PROFILE
+        if split_segments and single_main and not draft and not resources.is_hardware_codec(codecs):
+            split_starts = split_points(plan.video_duration, split_segments)
+        # Render theo layer cache (cần outro encode sẵn, chỉ bản 16:9 chính)
+        layered = layer_cache and single_main and not draft and not plan.layers.get("outro_in_graph")
+
+        try:
+            if layered:
+                render_layered(plan, asin_folder, render_paths[0], codecs, encoder_preset,
+                               ffmpeg_threads, progress_queue)
+            elif split_starts:
+                render_split(
+                    asin, asin_folder, plan.inputs, plan.video_fc, plan.video_label,
+                    plan.audio_fc or None, split_starts, plan.video_duration, render_paths[0],
+                    codecs, encoder_preset, ffmpeg_threads, progress_queue,
+                    audio_out=plan.audio_path, audio_args=plan.audio_args
+                )
             else:
-                x_expr = f"w-text_w-{subtitle_margin}"
-            
-            ffmpeg_font = get_ffmpeg_font_path()
-            
-            draw = (
-                f"drawtext=fontfile='{ffmpeg_font}'"
-                f":text='{txt}'"
-                f":x={x_expr}:y={subtitle_y}"
-                f":fontsize={final_fontsize}"
-                f":fontcolor={subtitle_fontcolor}"
-                f":borderw={subtitle_borderw}:bordercolor={subtitle_bordercolor}"
-            )
-            fc.append(f"{last}{draw}[vsub]")
-            last = "[vsub]"
+                ffmpeg_runner.run_ffmpeg(
+                    resources.apply_thread_budget(plan.cmd, ffmpeg_threads, render_paths), plan.expected_duration,
+                    on_progress=progress_queue.put if progress_queue is not None else None,
+                    label=asin,
+                    timeout=ffmpeg_runner.render_timeout(plan.expected_duration),
+                    stall_timeout=ffmpeg_runner.STALL_SECONDS,
+                    should_cancel=should_cancel
+                )
+
+            for out in plan.outputs:
+                if out.outtro_clip:
+                    concat_copy([out.render_path, out.outtro_clip], out.out_path, plan.audio_path,
+                                plan.expected_duration, should_cancel)
+                if sub_text and subtitle_mode in render_manifest.SOFT_SUBTITLE_MODES:
+                    attach_subtitle(out.out_path, sub_text, subtitle_mode)
+            finished = True
+        finally:
+            # Lỗi ở bất kỳ bước nào (render, nối outro, ghép phụ đề) không để lại file dở
+            leftovers = temp_paths + ([] if finished else [out.out_path for out in plan.outputs])
+            for path in leftovers:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return f"✅ [{asin}] {plan.out_path}"
 
-        if "logo" in idx_map:
-            logo_idx = idx_map["logo"]
-            logo_w = int(VIDEO_W * logo_scale_percent / 100)
-            fc.append(f"[{logo_idx}:v]scale={logo_w}:-1[logo_s]")
-            x = f"W-w-{logo_x}" if brand == "BlueStars" else str(logo_x)
-            fc.append(f"{last}[logo_s]overlay={x}:{logo_y}[vlogo]")
-            last = "[vlogo]"
-        if "outtro" in idx_map:
-            fc.append(f"[{idx_map['outtro']}:v]setpts=PTS-STARTPTS[outtro_norm]")
-            fc.append(f"{last}[outtro_norm]concat=n=2:v=1:a=0[vfinal]")
-            last = "[vfinal]"
-        
-        audio_labels = []
-        if "audio2" in idx_map:
-            fc.append(f"[{idx_map['audio2']}:a]volume={audio2_volume}[a2v]")
-            audio_labels.append("[a2v]")
-        if "audio1" in idx_map:
-            fc.append(f"[{idx_map['audio1']}:a]volume={audio1_volume}[a1v]")
-            audio_labels.append("[a1v]")
-        if audio_labels:
-            fc.append(f"{''.join(audio_labels)}amix=inputs={len(audio_labels)}:duration=first[aout]")
-
-        cmd = ["ffmpeg", "-y", "-hwaccel", "auto"] + inputs + [
-            "-filter_complex", ";".join(fc), "-map", last
-        ]
-        if audio_labels:
-            cmd += ["-map", "[aout]", "-c:a", "aac", "-b:a", "197k", "-ar", "48000", "-ac", "2","-aac_coder", "twoloop","-profile:a", "aac_low"]
-
-        cmd += [
-            "-c:v", codecs,
-            "-crf", "18",
-            "-b:v", "5M",
-            "-minrate", "4.5M", 
-            "-maxrate", "12M",
-            "-bufsize", "20M",
-            "-r", "29.97",
-            "-preset", "p5" if "nvenc" in codecs else "medium",
-            "-pix_fmt", "yuv420p",
-            "-colorspace", "bt709",
-            "-color_primaries", "bt709", 
-            "-color_trc", "bt709",
-            "-color_range", "tv",
-            "-movflags", "+faststart",
-            "-shortest",
-            out_path
-        ]
-
-        startupinfo = None
-        if platform.system() == 'Windows':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-
-        subprocess.run(
-            cmd, 
-            check=True, 
-            capture_output=True, 
-            text=True,
-            startupinfo=startupinfo,
-            encoding='utf-8',
-            errors='replace'
-        )
-        
-        # Clean up temp files
-        for temp_audio in [audio2] if audio2 and audio2.endswith("_a2.wav") else []:
-            try:
-                os.remove(temp_audio)
-            except Exception as e:
-                print(f"⚠️ Không thể xoá file tạm {temp_audio}: {e}")
-        
-        return f"✅ [{asin}] {out_path}"
-        
     except Exception as e:
         error_details = str(e)
+        if isinstance(e, ffmpeg_runner.RenderAborted):
+            return f"❌ [{asin}] aborted: {e.reason}"
         if isinstance(e, subprocess.CalledProcessError):
             error_details += f"\nFFMPEG STDERR:\n{e.stderr}"
         return f"❌ [{asin}] exception: {error_details}"
@@ -377,6 +953,92 @@ def create_video_wrapper(params):
     """Wrapper function for multiprocessing"""
     return create_video(**params)
 
+def queue_outcome(result: str) -> tuple:
+    """(state, output, error) to store in the render queue for a create_video result"""
+    if result.startswith("✅") and "] " in result:
+        return render_queue.DONE, result.split("] ", 1)[1].strip(), None
+    if "cancelled" in result:
+        return render_queue.CANCELLED, None, result
+    return render_queue.FAILED, None, result
+
+def split_limit(params: dict) -> int:
+    """Most segments create_video would split this job into (1 = it renders in one pass)"""
+    profiles = list(params.get("output_profiles") or [MAIN_PROFILE])
+    if (params.get("draft") or params.get("layer_cache") or profiles != [MAIN_PROFILE]
+            or resources.is_hardware_codec(params.get("codecs", "libx264"))):
+        return 1
+    duration = calculate_body_duration(params["media_paths"], params.get("cut_media2", True))
+    return max(1, int(duration // SPLIT_MIN_SEGMENT_SECONDS))
+
+def take_worker_slots(slots, limit: int = 1) -> int:
+    """Start one job on the shared slot counter (split_slots of main_web).
+
+    Returns how many worker slots the job may use (at most limit): 1, plus the
+    slots idle right now and not needed by a job still waiting to start. The
+    extra slots stay reserved until release_worker_slots.
+    """
+    state, lock = slots
+    with lock:
+        state["waiting"] -= 1
+        idle = max(0, state["capacity"] - state["running"] - 1 - state["waiting"])
+        taken = 1 + min(idle, max(0, limit - 1))
+        state["running"] += taken
+    return taken
+
+def release_worker_slots(slots, taken: int) -> None:
+    state, lock = slots
+    with lock:
+        state["running"] -= taken
+
+def create_video_queued(params):
+    """Claim the ASIN in the output folder's render queue, render it and record the outcome.
+
+    With split_slots, the job encodes in parallel segments when worker slots
+    are idle at the moment it starts (typically the tail of the batch).
+    """
+    params = dict(params)
+    slots = params.pop("split_slots", None)
+    taken = take_worker_slots(slots, split_limit(params)) if slots else 1
+    asin, folder = params["asin"], params["asin_folder"]
+    worker = render_queue.worker_id()
+    conn = render_queue.connect(folder)
+    try:
+        if not render_queue.claim(conn, asin, worker):
+            return f"⏭️ [{asin}] Already taken by another worker"
+        if taken >= 2:
+            params["split_segments"] = taken
+            params["ffmpeg_threads"] = resources.threads_per_job(slots[0]["capacity"])
+        stop = render_queue.start_heartbeat(
+            functools.partial(render_queue.heartbeat_folder, folder, asin, worker)
+        )
+        try:
+            result = create_video_wrapper(params)
+        finally:
+            stop.set()
+        state, output, error = queue_outcome(result)
+        render_queue.finish(conn, asin, state, output, error, worker=worker)
+        return result
+    finally:
+        conn.close()
+        if slots:
+            release_worker_slots(slots, taken)
+
+def get_render_workers(codecs: str = "libx264", job_count: int = None, heavy_inputs: bool = False) -> int:
+    """Pick the number of parallel ffmpeg renders for this host and codec (see resources.plan_workers)"""
+    return resources.plan_workers(codecs, job_count, heavy_inputs)
+
+def _drain_progress(progress_queue, progress_callback):
+    """Forward queued ffmpeg progress events to the caller's callback"""
+    while True:
+        try:
+            event = progress_queue.get_nowait()
+        except Exception:
+            return
+        try:
+            progress_callback(event)
+        except Exception as e:
+            print(f"⚠️ Progress callback failed: {e}")
+
 def main_web(
     excel_file="all.xlsx", output_root=".", logo_scale_percent: int = 15,
     logo_x: int = 50, logo_y: int = 50, brand: str = "BlueStars",
@@ -385,7 +1047,16 @@ def main_web(
     subtitle_y: int = 100, subtitle_fontsize: int = 85, subtitle_fontcolor: str = "#000000",
     subtitle_borderw: int = 2, subtitle_bordercolor: str = "#FFFFFF",
     subtitle_margin: int = 100,
-    subtitle_min_fontsize: int = 30
+    subtitle_min_fontsize: int = 30,
+    subtitle_mode: str = "drawtext",
+    force_render: bool = False,
+    enqueue_only: bool = False,
+    dry_run: bool = False,
+    draft: bool = False,
+    draft_fps: float = None,
+    output_profiles: list = None,
+    layer_cache: bool = False,
+    progress_callback=None
 ):
     logs, rendered = [], []
     df = pd.read_excel(excel_file)
@@ -393,49 +1064,258 @@ def main_web(
     if "ASIN" not in df.columns:
         logs.append("❌ Missing 'ASIN' column")
         return logs, rendered
-    if "Final" not in df.columns:
-        df["Final"] = ""
+
+    # Draft preview ghi vào thư mục riêng và cột Preview, không đụng tới bản final
+    final_col = "Preview" if draft else "Final"
+    if draft:
+        output_root = os.path.join(output_root, DRAFT_FOLDER)
+        os.makedirs(output_root, exist_ok=True)
+    if final_col not in df.columns:
+        df[final_col] = ""
 
     media_cols = [c for c in df.columns if c.startswith("Media") and c != "Media1"]
 
-    # ⭐ GIỮ NGUYÊN MULTIPROCESSING GỐC
-    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
-        for idx, row in df.iterrows():
-            asin = str(row["ASIN"]).strip()
-            media = [row[c] for c in media_cols if pd.notna(row.get(c))]
-            
-            params = {
-                "asin": asin, "media_paths": media,
-                "audio1": str(row.get("Audio1", "")) or None,
-                "audio2": str(row.get("Audio2", "")) or None,
-                "logo_path": str(row.get("Media1", "")) or None,
-                "asin_folder": output_root, "logo_scale_percent": logo_scale_percent,
-                "logo_x": logo_x, "logo_y": logo_y, "brand": brand,
-                "bluestars_outtro_path": bluestars_outtro_path, "codecs": codecs,
-                "cut_media2": cut_media2, "audio1_volume": audio1_volume,
-                "audio2_volume": audio2_volume, "sub_text": str(row.get("Subtitle", "")) or None,
-                "subtitle_align": subtitle_align, "subtitle_y": subtitle_y,
-                "subtitle_fontsize": subtitle_fontsize, "subtitle_fontcolor": subtitle_fontcolor,
-                "subtitle_borderw": subtitle_borderw, "subtitle_bordercolor": subtitle_bordercolor,
-                "subtitle_margin": subtitle_margin,
-                "subtitle_min_fontsize": subtitle_min_fontsize,
+    jobs = {}
+    for idx, row in df.iterrows():
+        asin = str(row["ASIN"]).strip()
+        media = [row[c] for c in media_cols if pd.notna(row.get(c))]
+
+        jobs[idx] = {
+            "asin": asin, "media_paths": media,
+            "audio1": str(row.get("Audio1", "")) or None,
+            "audio2": str(row.get("Audio2", "")) or None,
+            "logo_path": str(row.get("Media1", "")) or None,
+            "asin_folder": output_root, "logo_scale_percent": logo_scale_percent,
+            "logo_x": logo_x, "logo_y": logo_y, "brand": brand,
+            "bluestars_outtro_path": bluestars_outtro_path, "codecs": codecs,
+            "cut_media2": cut_media2, "audio1_volume": audio1_volume,
+            "audio2_volume": audio2_volume, "sub_text": str(row.get("Subtitle", "")) or None,
+            "subtitle_align": subtitle_align, "subtitle_y": subtitle_y,
+            "subtitle_fontsize": subtitle_fontsize, "subtitle_fontcolor": subtitle_fontcolor,
+            "subtitle_borderw": subtitle_borderw, "subtitle_bordercolor": subtitle_bordercolor,
+            "subtitle_margin": subtitle_margin,
+            "subtitle_min_fontsize": subtitle_min_fontsize,
+            "subtitle_mode": subtitle_mode,
+            "draft": draft, "draft_fps": draft_fps,
+            # Cùng một dạng cho webapp / pipeline / CLI để fingerprint khớp nhau
+            "output_profiles": [MAIN_PROFILE] if draft else list(output_profiles or [MAIN_PROFILE]),
+            "layer_cache": layer_cache,
+        }
+
+    # Hàng đợi bền vững: job đang chạy dở khi process trước chết được chạy lại
+    fingerprints = {idx: render_manifest.fingerprint(params) for idx, params in jobs.items()}
+    subtitle_fps = {idx: render_manifest.subtitle_fingerprint(params) for idx, params in jobs.items()}
+    if dry_run:
+        # Kiểm tra batch chỉ đọc: không đổi hàng đợi, manifest, Excel hay output
+        queue = render_queue.connect_readonly(output_root)
+    else:
+        queue = render_queue.connect(output_root)
+        recovered = render_queue.recover(queue)
+        if recovered:
+            logs.append(f"♻️ Resuming: {recovered} interrupted jobs back in the queue")
+        render_queue.sync(queue, jobs, fingerprints, force=force_render,
+                          outputs={idx: output_paths(params) for idx, params in jobs.items()})
+
+    # Bỏ qua ASIN có output còn nguyên và input không đổi so với lần render trước
+    manifest = render_manifest.load_manifest(output_root)
+    for idx, params in list(jobs.items()):
+        asin = params["asin"]
+        entry = render_queue.get(queue, asin) or {}
+        if force_render or entry.get("fingerprint") != fingerprints[idx]:
+            # Dòng cũ của input khác (dry run không sync hàng đợi)
+            entry = {}
+        outputs = output_paths(params)
+        if not force_render and render_manifest.is_up_to_date(manifest, asin, fingerprints[idx], outputs):
+            path = manifest[asin]["output"]
+            if manifest[asin].get("subtitle") != subtitle_fps[idx] and dry_run:
+                logs.append(f"📝 [{asin}] Subtitle changed, will be remuxed without re-render")
+            elif manifest[asin].get("subtitle") != subtitle_fps[idx]:
+                # Chỉ phụ đề mềm thay đổi: ghi lại SRT / remux track, không encode lại
+                try:
+                    update_soft_subtitles(params)
+                except Exception as e:
+                    logs.append(f"❌ [{asin}] subtitle update failed: {e}")
+                    continue
+                render_manifest.record(manifest, asin, fingerprints[idx], path, subtitle_fps[idx])
+                render_manifest.save_manifest(output_root, manifest)
+                logs.append(f"📝 [{asin}] Subtitle updated without re-render")
+        elif entry.get("state") == render_queue.DONE and entry.get("output") and all(os.path.exists(p) for p in outputs):
+            # Worker đã render xong nhưng process chính chết trước khi ghi manifest
+            path = entry["output"]
+            if not dry_run:
+                render_manifest.record(manifest, asin, fingerprints[idx], path, subtitle_fps[idx])
+                render_manifest.save_manifest(output_root, manifest)
+        elif entry.get("state") == render_queue.FAILED:
+            logs.append(f"❌ [{asin}] Failed {entry['attempts']} times, skipped (force render to retry)")
+            del jobs[idx]
+            continue
+        else:
+            continue
+        if entry.get("state") != render_queue.DONE and not dry_run:
+            render_queue.finish(queue, asin, render_queue.DONE, output=path)
+        logs.append(f"⏭️ [{asin}] Unchanged, skip render: {path}")
+        rendered.append(path)
+        df.loc[idx, final_col] = path
+        del jobs[idx]
+
+    if not jobs:
+        logs.append("⚠️ No rows to render")
+        queue.close()
+        if not dry_run:
+            df.to_excel(excel_file, index=False)
+        return logs, rendered
+
+    # Lập plan cho cả batch trước khi encode: bắt lỗi input sớm và ước lượng thời gian
+    infos = probe.probe_many([p for params in jobs.values() for p in params["media_paths"]])
+    plans = {idx: plan_video(**params, dry_run=True) for idx, params in jobs.items()}
+    for idx, plan in list(plans.items()):
+        if not plan.ok:
+            logs.append(plan.summary())
+            if not dry_run:
+                render_queue.finish(queue, plan.asin, render_queue.FAILED, error="; ".join(plan.problems))
+            del jobs[idx], plans[idx]
+        elif dry_run:
+            logs.append(plan.summary())
+
+    if not jobs:
+        logs.append("⚠️ No valid rows to render")
+        queue.close()
+        if not dry_run:
+            df.to_excel(excel_file, index=False)
+        return logs, rendered
+
+    # Job dài nhất chạy trước để cuối batch không còn một job lớn chạy một mình
+    jobs = dict(sorted(jobs.items(), key=lambda item: plans[item[0]].estimated_seconds, reverse=True))
+
+    # Số worker và số thread mỗi ffmpeg theo CPU thực có (cgroup-aware) và loại input
+    videos = [i for i in infos.values() if i and i.duration > 0]
+    heavy = sum(i.width * i.height >= resources.HEAVY_INPUT_PIXELS for i in videos) * 2 > len(videos)
+    capacity = get_render_workers(codecs, None, heavy)
+    max_workers = min(capacity, len(jobs))
+    ffmpeg_threads = resources.threads_per_job(max_workers)
+    total_seconds = estimate_batch_seconds([p.estimated_seconds for p in plans.values()], max_workers)
+    logs.append(f"⏱️ Estimated render time: {total_seconds / 60:.1f} min for {len(jobs)} ASINs "
+                f"on {max_workers} workers")
+
+    if dry_run:
+        queue.close()
+        return logs, rendered
+
+    # Chỉ đưa job vào hàng đợi, để các máy render (render_worker.py) tự nhận
+    if enqueue_only:
+        # Batch mới: bỏ cờ huỷ của lần chạy trước để worker không huỷ ngay mọi job
+        render_control.clear_cancel(output_root)
+        logs.append(f"📥 {len(jobs)} jobs queued in {render_queue.queue_path(output_root)}")
+        queue.close()
+        df.to_excel(excel_file, index=False)
+        return logs, rendered
+
+    # Xoá cờ huỷ của batch trước
+    render_control.clear_cancel(output_root)
+    batch_cancelled = functools.partial(render_control.is_cancelled, output_root)
+
+    try:
+        # Encode outro một lần cho cả batch trước khi các worker chạy song song
+        if bluestars_outtro_path and os.path.exists(bluestars_outtro_path) and not draft:
+            for profile in output_profiles or [MAIN_PROFILE]:
+                w, h = OUTPUT_PROFILES[profile]["size"]
+                media_cache.encoded_outro(bluestars_outtro_path, get_profile_encode_args(profile, codecs),
+                                          w, h, fit=outro_fit(profile), should_cancel=batch_cancelled)
+
+        # Decode nhạc nền một lần cho cả batch (mỗi file + volume), các job chỉ đọc đoạn PCM cần dùng
+        for params in jobs.values():
+            music = params.get("audio1")
+            if music and os.path.exists(music):
+                seconds = calculate_body_duration(params["media_paths"], params["cut_media2"]) + media_cache.OUTRO_DURATION
+                media_cache.decoded_music(music, params["audio1_volume"], seconds, should_cancel=batch_cancelled)
+    except ffmpeg_runner.RenderAborted as e:
+        # Job tự encode lại phần còn thiếu (và tự dừng nếu batch đã bị huỷ)
+        logs.append(f"⚠️ Batch pre-encode stopped: {e.reason}")
+
+    # Resize logo một lần, các worker dùng chung file PNG đã scale
+    logo_w = int(VIDEO_W * logo_scale_percent / 100)
+    for logo in {params["logo_path"] for params in jobs.values()}:
+        if logo and os.path.exists(logo):
+            media_cache.scaled_logo(logo, logo_w)
+
+    logs.append(f"🚀 Rendering {len(jobs)} ASINs with {max_workers} workers "
+                f"x {ffmpeg_threads} threads ({codecs})")
+
+    # Tiến độ ffmpeg của từng worker được gửi về qua queue, progress_callback chạy ở process chính
+    manager = None
+    progress_queue = None
+    if progress_callback:
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+
+    # Slot worker bỏ trống lúc một job bắt đầu (cuối batch, batch nhỏ hơn số slot) được job đó
+    # dùng để encode song song từng đoạn; quyết định khi job chạy, không phải khi submit
+    split_slots = None
+    if capacity >= 2 and not draft and not resources.is_hardware_codec(codecs):
+        manager = manager or multiprocessing.Manager()
+        split_slots = (manager.dict(capacity=capacity, running=0, waiting=len(jobs)), manager.Lock())
+
+    try:
+        # Submit toàn bộ ASIN trước, thu kết quả theo thứ tự hoàn thành
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            future_to_job = {
+                executor.submit(create_video_queued, dict(
+                    params, progress_queue=progress_queue, split_slots=split_slots, ffmpeg_threads=ffmpeg_threads
+                )): (idx, params["asin"])
+                for idx, params in jobs.items()
             }
-            
+
+            pending = set(future_to_job)
             try:
-                result = executor.submit(create_video_wrapper, params).result()
-                logs.append(result)
-                
-                # Check if successful and add to rendered paths
-                if result.startswith("✅") and "] " in result:
-                    try:
-                        path = result.split("] ")[1].strip()
-                        if os.path.exists(path):
-                            rendered.append(path)
-                            df.loc[idx, "Final"] = path
-                    except:
-                        pass
-            except Exception as e:
-                logs.append(f"❌ [{asin}] exception: {str(e)}")
+                while pending:
+                    done, pending = concurrent.futures.wait(
+                        pending, timeout=PROGRESS_POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    if progress_queue is not None:
+                        _drain_progress(progress_queue, progress_callback)
+
+                    # Huỷ cả batch: bỏ các job chưa chạy, job đang chạy tự dừng qua watchdog
+                    if render_control.is_cancelled(output_root):
+                        for fut in list(pending):
+                            if fut.cancel():
+                                pending.discard(fut)
+                                logs.append(f"❌ [{future_to_job[fut][1]}] cancelled before start")
+
+                    for fut in done:
+                        idx, asin = future_to_job[fut]
+                        try:
+                            result = fut.result()
+                            logs.append(result)
+
+                            # Check if successful and add to rendered paths
+                            if result.startswith("✅") and "] " in result:
+                                try:
+                                    path = result.split("] ")[1].strip()
+                                    if os.path.exists(path):
+                                        rendered.append(path)
+                                        df.loc[idx, final_col] = path
+                                        render_manifest.record(manifest, asin, fingerprints[idx], path, subtitle_fps[idx])
+                                        render_manifest.save_manifest(output_root, manifest)
+                                except:
+                                    pass
+                            elif result.startswith(f"❌ [{asin}] aborted"):
+                                logs.append(f"🔓 [{asin}] Worker slot released, {len(pending)} jobs left")
+                        except Exception as e:
+                            logs.append(f"❌ [{asin}] exception: {str(e)}")
+            except BaseException:
+                # Script bị dừng giữa chừng (vd. Streamlit stop/rerun): huỷ batch để worker không chạy tiếp
+                render_control.request_cancel(output_root)
+                raise
+        if progress_queue is not None:
+            _drain_progress(progress_queue, progress_callback)
+    finally:
+        # Batch bị huỷ / rerun cũng tắt process của Manager ngay
+        if manager is not None:
+            manager.shutdown()
+
+    state_counts = render_queue.counts(queue)
+    queue.close()
+    logs.append("📋 Queue: " + ", ".join(f"{n} {state}" for state, n in sorted(state_counts.items())))
 
     df.to_excel(excel_file, index=False)
     return logs, rendered
@@ -18,6 +18,8 @@ import tts
 import get_add
 import script_gemini
 import prompt
+import fonts
+import render_control
 
 # CSS cho drag-drop và preview
 st.markdown("""
@@ -1455,6 +1457,12 @@ subtitle_fontcolor = st.color_picker("Font color", value="#000000")
 subtitle_bordercolor = st.color_picker("Border color", value="#FFFFFF")
 subtitle_margin = st.slider("Side margins (px)", min_value=10, max_value=300, value=100)
 subtitle_min_fontsize = st.slider("Minimum font size (px)", min_value=10, max_value=50, value=30)
+subtitle_mode = st.selectbox(
+    "Subtitle rendering:", options=["drawtext", "image", "track", "srt"], index=0,
+    help="image: burn the subtitle as a pre-rendered PNG overlay (identical to the preview, faster per frame). "
+         "track: soft subtitle muxed as a mov_text track plus an .srt file; srt: only the .srt file next to the video. "
+         "Soft subtitles are not burned in, so editing them later is a quick remux instead of a re-render"
+)
 
 # Preview
 st.subheader("Preview logo & subtitle")
@@ -1476,15 +1484,16 @@ if logo_path and os.path.exists(logo_path):
         canvas.paste(logo, (px, py))
 
     try:
-        font = ImageFont.truetype("arialbd.ttf", size=80)
-        bbox = draw.textbbox((0, 0), sub_text, font=font)
-        text_w = bbox[2] - bbox[0]
-        sub_x = (VIDEO_W - text_w) // 2
-
-        for dx in (-subtitle_borderw, subtitle_borderw):
-            for dy in (-subtitle_borderw, subtitle_borderw):
-                draw.text((sub_x + dx, subtitle_y + dy), sub_text, font=font, fill=subtitle_bordercolor)
-        draw.text((sub_x, subtitle_y), sub_text, font=font, fill=subtitle_fontcolor)
+        # Dùng chung code với chế độ subtitle "image" khi render để preview khớp video
+        system_font = fonts.get_system_font()
+        preview_fontsize = fonts.fit_font_size(
+            sub_text, system_font, VIDEO_W - 2 * subtitle_margin,
+            subtitle_fontsize, subtitle_min_fontsize
+        )
+        fonts.draw_subtitle(
+            canvas, sub_text, system_font, preview_fontsize, subtitle_fontcolor,
+            subtitle_borderw, subtitle_bordercolor, subtitle_align, subtitle_y, subtitle_margin
+        )
     except:
         pass
 
@@ -1513,8 +1522,79 @@ else:
 # Media2 processing options
 st.subheader("Media2 processing options")
 cut_media2 = st.checkbox("✂️ Cut 9s from middle of Media2 video (recommended if Media2 is long)", value=True)
+force_render = st.checkbox("🔁 Re-render all ASINs (ignore unchanged videos)", value=False)
+draft_low_fps = st.checkbox("🐢 Draft preview at 15 fps (faster review renders)", value=False)
+layer_cache = st.checkbox(
+    "🧱 Cache render layers (re-voicing / subtitle fixes only re-run the changed step)", value=False,
+    help="Keeps the encoded body (media + logo) and the subtitled video in the media cache. The first render is slower (one extra intermediate encode); later renders with only new audio are a stream-copy remux"
+)
+extra_formats = st.multiselect(
+    "📐 Extra output formats (rendered in the same pass as the 16:9 video)",
+    [p for p in video.OUTPUT_PROFILES if p != video.MAIN_PROFILE],
+    default=[],
+    help="9x16 pads the 16:9 frame into a vertical video, 9x16_crop crops its center; files get a _9x16 / _9x16_crop / _720p suffix"
+)
 
-if st.button("Render video", key="btn_video"):
+# Dừng batch đang chạy: worker thấy cờ huỷ trong thư mục output và kill ffmpeg
+if st.button("⏹️ Cancel render", key="btn_cancel_video",
+             help="Stop the running batch. A single ASIN can be cancelled with: python render_control.py cancel <output folder> <ASIN>"):
+    render_control.request_cancel(output_folder)
+    render_control.request_cancel(os.path.join(output_folder, video.DRAFT_FOLDER))
+    add_log_to_sidebar("Render cancelled by operator.", "warning")
+    st.warning("⏹️ Render cancelled. Running ffmpeg jobs are being stopped.")
+
+# Tham số render dùng chung cho render, draft và kiểm tra batch
+render_settings = dict(
+    excel_file=excel_filename,
+    output_root=output_folder,
+    logo_scale_percent=logo_scale_percent,
+    logo_x=logo_x,
+    logo_y=logo_y,
+    brand=brand,
+    bluestars_outtro_path=bluestars_outtro_path,
+    codecs=selected_codec,
+    audio1_volume=audio1_vol_percent / 100,
+    audio2_volume=audio2_vol_percent / 100,
+    cut_media2=cut_media2,
+    subtitle_align=subtitle_align,
+    subtitle_y=subtitle_y,
+    subtitle_fontsize=subtitle_fontsize,
+    subtitle_fontcolor=subtitle_fontcolor,
+    subtitle_borderw=subtitle_borderw,
+    subtitle_bordercolor=subtitle_bordercolor,
+    subtitle_margin=subtitle_margin,
+    subtitle_min_fontsize=subtitle_min_fontsize,
+    subtitle_mode=subtitle_mode,
+    force_render=force_render,
+    output_profiles=[video.MAIN_PROFILE] + extra_formats,
+    layer_cache=layer_cache,
+)
+
+# Lập plan cả batch không encode: báo input lỗi và thời gian render dự kiến
+if st.button("🧮 Check batch & estimate render time", key="btn_video_plan"):
+    if not os.path.exists(excel_filename):
+        st.error(f"Excel file {os.path.basename(excel_filename)} does not exist.")
+    else:
+        with st.spinner("Planning renders..."):
+            logs_plan, _ = video.main_web(**render_settings, dry_run=True)
+        problems = [msg for msg in logs_plan if msg.startswith("❌")]
+        for msg in logs_plan:
+            add_log_to_sidebar(msg, "error" if msg.startswith("❌") else "info")
+        estimate = next((msg for msg in logs_plan if msg.startswith("⏱️")), None)
+        if estimate:
+            st.info(estimate)
+        if problems:
+            st.error(f"⚠️ {len(problems)} ASINs cannot be rendered:\n\n" + "\n\n".join(problems))
+        elif estimate:
+            st.success("✅ All ASINs are ready to render.")
+
+render_clicked = st.button("Render video", key="btn_video")
+draft_clicked = st.button(
+    "📝 Render draft preview (540p)", key="btn_video_draft",
+    help=f"Same layout as the final video, ultrafast encode into '{video.DRAFT_FOLDER}' inside the output folder"
+)
+
+if render_clicked or draft_clicked:
     if not os.path.exists(excel_filename):
         st.error(f"Excel file {os.path.basename(excel_filename)} does not exist.")
     else:
@@ -1526,27 +1606,32 @@ if st.button("Render video", key="btn_video"):
                 st.error(f"Error creating output folder {output_folder}: {e}")
                 st.stop()
 
-        add_log_to_sidebar("🚀 Starting video rendering...", "step")
+        add_log_to_sidebar("🚀 Starting draft preview rendering..." if draft_clicked else "🚀 Starting video rendering...", "step")
+
+        # Tiến độ từng ASIN (fps, tốc độ, %, ETA) cập nhật trực tiếp trong lúc render
+        render_progress = {}
+        progress_placeholder = st.empty()
+
+        def show_render_progress(event):
+            render_progress[event["label"]] = event
+            lines = []
+            for asin_p, ev in render_progress.items():
+                eta = f"{ev['eta']:.0f}s" if ev["eta"] is not None else "?"
+                if ev.get("aborted"):
+                    status = f"⏹️ {ev['aborted']}"
+                else:
+                    status = "✅" if ev["done"] else ("⚠️ slow" if ev["slow"] else "⏳")
+                lines.append(
+                    f"{status} **{asin_p}** {ev['percent']:.0f}% · {ev['fps']:.0f} fps · "
+                    f"{ev['speed']:.2f}x · ETA {eta}"
+                )
+            progress_placeholder.markdown("\n\n".join(lines))
+
         logs_video, rendered_paths = video.main_web(
-            excel_file=excel_filename,
-            output_root=output_folder,
-            logo_scale_percent=logo_scale_percent,
-            logo_x=logo_x,
-            logo_y=logo_y,
-            brand=brand,
-            bluestars_outtro_path=bluestars_outtro_path,
-            codecs=selected_codec,
-            audio1_volume=audio1_vol_percent / 100,
-            audio2_volume=audio2_vol_percent / 100,
-            cut_media2=cut_media2,
-            subtitle_align=subtitle_align,
-            subtitle_y=subtitle_y,
-            subtitle_fontsize=subtitle_fontsize,
-            subtitle_fontcolor=subtitle_fontcolor,
-            subtitle_borderw=subtitle_borderw,
-            subtitle_bordercolor=subtitle_bordercolor,
-            subtitle_margin=subtitle_margin,
-            subtitle_min_fontsize=subtitle_min_fontsize
+            **render_settings,
+            draft=draft_clicked,
+            draft_fps=15 if draft_clicked and draft_low_fps else None,
+            progress_callback=show_render_progress
         )
 
         success_logs = []